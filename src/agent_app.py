@@ -4,50 +4,39 @@ Provides natural language interface to geocoding, routing, and POI search
 """
 
 import os
-import json
+import sys
 import asyncio
+import contextlib
+import logging
+import threading
 import warnings
-from typing import Dict, Any, List
-from dotenv import load_dotenv
-from openai import OpenAI
-from servers.osm_server import OSMGeoMCP
-from servers.ors_server import RouteMCP
+from collections import OrderedDict
+from typing import Dict, Any, List, Optional
+import orjson
+
+# openai, dotenv and the map servers are imported on first use to keep CLI start-up fast
 
 warnings.filterwarnings("ignore", category=DeprecationWarning)
 
-load_dotenv()
+logger = logging.getLogger(__name__)
 
+# Read-only tools whose results are cached for the session, keyed on their arguments
+CACHEABLE_TOOLS = frozenset({
+    "osm_forward_geocode",
+    "osm_reverse_geocode",
+    "osm_poi_search",
+    "ors_matrix",
+})
+TOOL_CACHE_SIZE = 512
+
+MODEL = "gpt-4o-mini"
+
+# Instructions and tools are sent unchanged on every turn, so the prompt prefix
+# stays identical and is served from OpenAI's prompt cache
+PROMPT_CACHE_KEY = "map-assistant"
+
+INSTRUCTIONS = """You are MapAssistant, a helpful AI assistant specializing in geographic information and routing.
 
-class MapAssistant:
- 
-    def __init__(self, auto_approve: bool = True):
-   
-        api_key = os.getenv("OPENAI_API_KEY")
-        if not api_key:
-            raise ValueError("OPENAI_API_KEY not found in environment variables")
-        
-        self.client = OpenAI(api_key=api_key)
-        self.auto_approve = auto_approve
-        
-        self.osm_server = OSMGeoMCP()
-        self.ors_server = RouteMCP()
-        
-        self.tools = (
-            self.osm_server.get_tool_definitions() + 
-            self.ors_server.get_tool_definitions()
-        )
-        
-        self.assistant = self._create_assistant()
-        
-        print(f"✓ MapAssistant initialized with {len(self.tools)} tools")
-        print(f"  - OSM tools: forward_geocode, reverse_geocode, poi_search")
-        print(f"  - ORS tools: route, isochrone, matrix")
-    
-    def _create_assistant(self):
-        assistant = self.client.beta.assistants.create(
-            name="MapAssistant",
-            instructions="""You are MapAssistant, a helpful AI assistant specializing in geographic information and routing.
-            
 You have access to two map server systems:
 
 1. **OSMGeoMCP** (OpenStreetMap) - for geocoding and POI search:
@@ -66,117 +55,286 @@ Important notes:
 - Coordinates are in [longitude, latitude] format for ORS tools
 - Distances are in meters, durations in seconds
 - Always provide clear, user-friendly responses with relevant details
-""",
-            model="gpt-4o-mini",
-            tools=self.tools
-        )
-        return assistant
+"""
+
+# Written in a single call rather than one print() per line
+BANNER = (
+    "\n" + "=" * 60 + "\n"
+    "MapAssistant - Interactive Mode\n"
+    + "=" * 60 + "\n"
+    "Ask me anything about locations, routes, or points of interest!\n"
+    "Examples:\n"
+    "  - What's the address at coordinates 48.8584, 2.2945?\n"
+    "  - Find restaurants near the Eiffel Tower\n"
+    "  - Route from Paris to Lyon by car\n"
+    "  - How far can I drive in 15 minutes from Central Park?\n"
+    "\nType 'exit' or 'quit' to end the session.\n\n"
+)
+
+
+async def ainput(prompt: str = "") -> str:
+    """
+    Read a line from stdin without blocking the event loop.
+    Uses a daemon thread so a pending read never holds up interpreter exit.
+    """
+    loop = asyncio.get_running_loop()
+    future = loop.create_future()
+    
+    def resolve(setter, value):
+        if not future.done():
+            setter(value)
     
-    async def _execute_tool(self, tool_name: str, arguments: Dict[str, Any]) -> Dict[str, Any]:
+    def read():
         try:
-            if tool_name.startswith("osm_"):
-                result = await self.osm_server.execute_tool(tool_name, arguments)
-            elif tool_name.startswith("ors_"):
-                result = await self.ors_server.execute_tool(tool_name, arguments)
-            else:
-                return {"error": f"Unknown tool: {tool_name}"}
-            
-            return result
-        except Exception as e:
-            return {"error": str(e)}
+            line = input(prompt)
+        except BaseException as e:
+            loop.call_soon_threadsafe(resolve, future.set_exception, e)
+        else:
+            loop.call_soon_threadsafe(resolve, future.set_result, line)
     
-    async def process_query(self, query: str, thread_id: str = None) -> str:
+    threading.Thread(target=read, daemon=True).start()
+    return await future
+
+
+class MapAssistant:
+ 
+    def __init__(self, auto_approve: bool = True, stream: bool = True):
+        import httpx
+        from dotenv import load_dotenv
+        from openai import AsyncOpenAI
+        from servers import OSMGeoMCP, RouteMCP, TOOL_DEFINITIONS
         
-        if thread_id is None:
-            thread = self.client.beta.threads.create()
-            thread_id = thread.id
+        load_dotenv()
         
-        self.client.beta.threads.messages.create(
-            thread_id=thread_id,
-            role="user",
-            content=query
+        api_key = os.getenv("OPENAI_API_KEY")
+        if not api_key:
+            raise ValueError("OPENAI_API_KEY not found in environment variables")
+        
+        self.client = AsyncOpenAI(api_key=api_key)
+        self.auto_approve = auto_approve
+        self.stream = stream
+        
+        # One pooled HTTP/2 client shared by both map servers; each server sets its own
+        # ServerParams.timeout on every request, so the client carries none
+        self._http = httpx.AsyncClient(
+            http2=True,
+            limits=httpx.Limits(max_keepalive_connections=32, max_connections=64)
         )
+        self.osm_server = OSMGeoMCP(client=self._http)
+        self.ors_server = RouteMCP(client=self._http)
+        
+        self.tools = TOOL_DEFINITIONS
+        # The Responses API takes flat function tools rather than the nested chat format
+        self._response_tools = [
+            {"type": "function", **tool["function"], "strict": False}
+            for tool in self.tools
+        ]
         
-        run = self.client.beta.threads.runs.create(
-            thread_id=thread_id,
-            assistant_id=self.assistant.id
+        # Map every tool name to the server that implements it
+        self._tool_owner = {
+            tool["function"]["name"]: server
+            for server in (self.osm_server, self.ors_server)
+            for tool in server.get_tool_definitions()
+        }
+        self._tool_cache = OrderedDict()
+        
+        # Conversation state is carried between turns by the previous response id
+        self._previous_response_id = None
+        self._connection = None
+        
+        sys.stdout.write(
+            f"✓ MapAssistant initialized with {len(self.tools)} tools\n"
+            "  - OSM tools: forward_geocode, reverse_geocode, poi_search\n"
+            "  - ORS tools: route, isochrone, matrix\n"
         )
+    
+    def _response_params(self, previous_response_id: Optional[str]) -> Dict[str, Any]:
+        params = dict(
+            instructions=INSTRUCTIONS,
+            model=MODEL,
+            tools=self._response_tools,
+            prompt_cache_key=PROMPT_CACHE_KEY
+        )
+        if previous_response_id is not None:
+            params["previous_response_id"] = previous_response_id
+        return params
+    
+    async def _connect(self):
+        # One persistent Responses WebSocket for the whole session
+        if self._connection is None:
+            self._connection = await self.client.responses.connect().enter()
+        return self._connection
+    
+    async def warmup(self):
+        await asyncio.gather(self.osm_server.warmup(), self.ors_server.warmup())
+    
+    async def aclose(self):
+        if self._connection is not None:
+            await self._connection.close()
+            self._connection = None
+        # Servers leave the injected HTTP client open but close their response caches
+        await self.osm_server.aclose()
+        await self.ors_server.aclose()
+        await self._http.aclose()
+        await self.client.close()
+    
+    async def _execute_tool(self, tool_name: str, arguments: Dict[str, Any]) -> bytes:
+        owner = self._tool_owner.get(tool_name)
+        if owner is None:
+            return orjson.dumps({"error": f"Unknown tool: {tool_name}"})
+        
+        cache_key = None
+        if tool_name in CACHEABLE_TOOLS:
+            cache_key = (tool_name, orjson.dumps(arguments, option=orjson.OPT_SORT_KEYS))
+            if (cached := self._tool_cache.get(cache_key)) is not None:
+                self._tool_cache.move_to_end(cache_key)
+                return cached
+        
+        # Results come back as JSON bytes, serialized once by the server and cached as-is
+        try:
+            result = await owner.execute_tool_bytes(tool_name, arguments)
+        except Exception as e:
+            return orjson.dumps({"error": str(e)})
+        
+        # Errors are never cached, so a failed lookup is retried next time
+        if cache_key is not None:
+            self._tool_cache[cache_key] = result
+            if len(self._tool_cache) > TOOL_CACHE_SIZE:
+                self._tool_cache.popitem(last=False)
+        
+        return result
+    
+    async def process_query(self, query: str, echo: bool = False) -> str:
+        """Answer a query; with echo=True the reply is also written to stdout, streamed when possible"""
+        input_items = [{"role": "user", "content": query}]
+        streamed = False
+        
+        # The chain is only committed once a response needs no tool outputs, so a failed or
+        # cancelled tool round-trip never leaves the session chained to unanswered calls
+        previous_response_id = self._previous_response_id
         
         while True:
-            run_status = self.client.beta.threads.runs.retrieve(
-                thread_id=thread_id,
-                run_id=run.id
-            )
+            if self.stream:
+                response, echoed = await self._stream_response(
+                    input_items, previous_response_id, echo, header=not streamed
+                )
+                streamed = streamed or echoed
+            else:
+                response = await self.client.responses.create(
+                    **self._response_params(previous_response_id), input=input_items
+                )
+            
+            if response.status != "completed":
+                return f"Error: Response {response.status}"
+            
+            previous_response_id = response.id
             
-            if run_status.status == "completed":
+            function_calls = [item for item in response.output if item.type == "function_call"]
+            if not function_calls:
                 break
             
-            elif run_status.status == "requires_action":
-                tool_calls = run_status.required_action.submit_tool_outputs.tool_calls
-                tool_outputs = []
-                
-                for tool_call in tool_calls:
-                    tool_name = tool_call.function.name
-                    arguments = json.loads(tool_call.function.arguments)
-                    
-                    print(f"\n🔧 Tool call: {tool_name}")
-                    print(f"   Arguments: {json.dumps(arguments, indent=2)}")
-                    
-                    if not self.auto_approve:
-                        approve = input("   Execute? (y/n): ").lower().strip()
-                        if approve != 'y':
-                            output = json.dumps({"error": "Tool call rejected by user"})
-                            tool_outputs.append({
-                                "tool_call_id": tool_call.id,
-                                "output": output
-                            })
-                            continue
-                    
-                    result = await self._execute_tool(tool_name, arguments)
-                    print(f"   ✓ Result: {json.dumps(result, indent=2)[:200]}...")
-                    
-                    tool_outputs.append({
-                        "tool_call_id": tool_call.id,
-                        "output": json.dumps(result)
-                    })
-                
-                self.client.beta.threads.runs.submit_tool_outputs(
-                    thread_id=thread_id,
-                    run_id=run.id,
-                    tool_outputs=tool_outputs
-                )
+            # Tool outputs go back as the input of the next response in the chain
+            input_items = await self._run_tool_calls(function_calls)
+        
+        self._previous_response_id = previous_response_id
+        
+        text = response.output_text or "No response from assistant"
+        
+        if echo and not streamed:
+            print(f"\n🤖 MapAssistant:\n{text}")
+        
+        return text
+    
+    async def _stream_response(
+        self,
+        input_items: List[Dict[str, Any]],
+        previous_response_id: Optional[str],
+        echo: bool,
+        header: bool
+    ):
+        connection = await self._connect()
+        echoed = False
+        
+        try:
+            await connection.response.create(**self._response_params(previous_response_id), input=input_items)
             
-            elif run_status.status in ["failed", "cancelled", "expired"]:
-                return f"Error: Run {run_status.status}"
+            async for event in connection:
+                if event.type == "response.output_text.delta":
+                    # Print tokens as they arrive instead of waiting for the whole message
+                    if echo:
+                        if header and not echoed:
+                            sys.stdout.write("\n🤖 MapAssistant:\n")
+                        sys.stdout.write(event.delta)
+                        sys.stdout.flush()
+                        echoed = True
+                elif event.type in ("response.completed", "response.failed", "response.incomplete"):
+                    return event.response, echoed
+                elif event.type == "error":
+                    raise RuntimeError(event.error.message)
+        except Exception:
+            # Drop the socket so the next query reconnects with a clean state
+            self._connection = None
+            with contextlib.suppress(Exception):
+                await connection.close()
+            raise
+        
+        raise RuntimeError("Responses connection closed before the response completed")
+    
+    async def _run_tool_calls(self, tool_calls) -> List[Dict[str, str]]:
+        from servers import decode_arguments
+        
+        outputs = {}
+        approved = []
+        
+        for tool_call in tool_calls:
+            tool_name = tool_call.name
+            print(f"\n🔧 Tool call: {tool_name}")
+            
+            # Typed decoding validates the model's arguments before any request is made
+            try:
+                arguments = decode_arguments(tool_name, tool_call.arguments)
+            except ValueError as e:
+                print(f"   ✗ {e}")
+                outputs[tool_call.call_id] = orjson.dumps({"error": str(e)}).decode()
+                continue
             
-            await asyncio.sleep(1)
+            print(f"   Arguments: {orjson.dumps(arguments, option=orjson.OPT_INDENT_2).decode()}")
+            
+            if not self.auto_approve:
+                approve = (await ainput("   Execute? (y/n): ")).lower().strip()
+                if approve != 'y':
+                    outputs[tool_call.call_id] = orjson.dumps({"error": "Tool call rejected by user"}).decode()
+                    continue
+            
+            approved.append((tool_call, tool_name, arguments))
         
-        messages = self.client.beta.threads.messages.list(thread_id=thread_id)
-        latest_message = messages.data[0]
+        # Approved calls are independent, so run them concurrently
+        results = await asyncio.gather(
+            *(self._execute_tool(tool_name, arguments) for _, tool_name, arguments in approved),
+            return_exceptions=True
+        )
         
-        if latest_message.role == "assistant":
-            response_text = latest_message.content[0].text.value
-            return response_text
+        for (tool_call, tool_name, _), result in zip(approved, results):
+            if isinstance(result, BaseException):
+                result = orjson.dumps({"error": str(result)})
+            print(f"\n   ✓ Result received: {tool_name}")
+            if logger.isEnabledFor(logging.DEBUG):
+                # Truncate the compact bytes rather than pretty-printing the whole payload
+                logger.debug("%s result: %s...", tool_name, result[:200].decode(errors="replace"))
+            outputs[tool_call.call_id] = result.decode()
         
-        return "No response from assistant"
+        return [
+            {"type": "function_call_output", "call_id": tool_call.call_id, "output": outputs[tool_call.call_id]}
+            for tool_call in tool_calls
+        ]
     
     async def run_interactive(self):
-        print("\n" + "="*60)
-        print("MapAssistant - Interactive Mode")
-        print("="*60)
-        print("Ask me anything about locations, routes, or points of interest!")
-        print("Examples:")
-        print("  - What's the address at coordinates 48.8584, 2.2945?")
-        print("  - Find restaurants near the Eiffel Tower")
-        print("  - Route from Paris to Lyon by car")
-        print("  - How far can I drive in 15 minutes from Central Park?")
-        print("\nType 'exit' or 'quit' to end the session.\n")
-        
-        thread_id = None
+        sys.stdout.write(BANNER)
+        sys.stdout.flush()
         
         while True:
             try:
-                query = input("> ").strip()
+                query = (await ainput("> ")).strip()
                 
                 if not query:
                     continue
@@ -186,11 +344,10 @@ Important notes:
                     break
                 
                 print("\n💭 Thinking...")
-                response = await self.process_query(query, thread_id)
-                
-                print(f"\n🤖 MapAssistant:\n{response}\n")
+                await self.process_query(query, echo=True)
+                print("\n")
                 
-            except KeyboardInterrupt:
+            except (KeyboardInterrupt, EOFError, asyncio.CancelledError):
                 print("\n\nGoodbye! 👋")
                 break
             except Exception as e:
@@ -200,8 +357,7 @@ Important notes:
 async def main():
     try:
         assistant = MapAssistant(auto_approve=True)
-        
-        await assistant.run_interactive()
+        logging.basicConfig(level=os.getenv("LOG_LEVEL", "WARNING").upper())
         
     except Exception as e:
         print(f"❌ Failed to initialize MapAssistant: {str(e)}")
@@ -210,6 +366,16 @@ async def main():
         print("  2. Installed all requirements: pip install -r requirements.txt")
         return 1
     
+    # Preconnect to the map APIs in the background while the user types the first query
+    warmup = asyncio.create_task(assistant.warmup())
+    try:
+        await assistant.run_interactive()
+    finally:
+        warmup.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await warmup
+        await assistant.aclose()
+    
     return 0
 
 
@@ -1,5 +1,9 @@
 """Server package initialization"""
 from .osm_server import OSMGeoMCP
 from .ors_server import RouteMCP
+from .tool_args import decode_arguments
 
-__all__ = ["OSMGeoMCP", "RouteMCP"]
+# Combined tool schemas for every server, built once at import
+TOOL_DEFINITIONS = OSMGeoMCP.get_tool_definitions() + RouteMCP.get_tool_definitions()
+
+__all__ = ["OSMGeoMCP", "RouteMCP", "TOOL_DEFINITIONS", "decode_arguments"]
@@ -0,0 +1,126 @@
+"""
+On-disk cache of raw API responses shared by the map servers
+Stores response bodies in SQLite keyed by a hash of the canonicalized request
+"""
+
+import hashlib
+import os
+import sqlite3
+import time
+from typing import Any, Optional
+import json
+
+try:
+    import orjson
+
+    def _canonical(value: Any) -> bytes:
+        return orjson.dumps(value, option=orjson.OPT_SORT_KEYS)
+except ImportError:  # fall back to the stdlib encoder if orjson is not installed
+    def _canonical(value: Any) -> bytes:
+        return json.dumps(value, sort_keys=True, separators=(",", ":")).encode()
+
+
+DEFAULT_CACHE_DIR = "~/.cache/mapmcp"
+
+# Expiry per upstream service, in seconds
+ORS_TTL = 24 * 60 * 60             # routes/isochrones/matrices: 24 hours
+NOMINATIM_TTL = 30 * 24 * 60 * 60  # geocoding results: 30 days
+OVERPASS_TTL = 24 * 60 * 60        # POI data: 24 hours
+
+# Entries kept per database; past this the least recently used ones are evicted
+DEFAULT_MAX_ENTRIES = 10_000
+
+
+def resolve_cache_dir(cache_dir: Optional[str]) -> Optional[str]:
+    """
+    Pick the cache directory for a server.
+
+    An explicit `cache_dir` wins, then the MAP_CACHE_DIR environment variable,
+    then DEFAULT_CACHE_DIR. An empty string from either source disables caching.
+    """
+    if cache_dir is None:
+        cache_dir = os.getenv("MAP_CACHE_DIR", DEFAULT_CACHE_DIR)
+    return os.path.expanduser(cache_dir) if cache_dir else None
+
+
+# Value marking an entry as the most recently used one
+_NEXT_USE = "(SELECT COALESCE(MAX(last_used), 0) + 1 FROM responses)"
+
+
+class ResponseCache:
+    """
+    SQLite-backed LRU cache of API response bodies with a per-entry expiry.
+
+    Bodies are stored exactly as received, so cached responses go through the
+    same parsing and transformation as fresh ones. At most `max_entries` are
+    kept; each hit or store marks an entry as most recently used, and `set`
+    evicts the least recently used ones beyond the cap.
+
+    Example:
+        >>> cache = ResponseCache("~/.cache/mapmcp")
+        >>> key = cache.key("GET", url, params)
+        >>> cache.set(key, response.content, NOMINATIM_TTL)
+        >>> cache.get(key)
+    """
+
+    def __init__(self, cache_dir: str, filename: str = "responses.sqlite3", max_entries: int = DEFAULT_MAX_ENTRIES):
+        """Open (and create if needed) the cache database in `cache_dir`"""
+        cache_dir = os.path.expanduser(cache_dir)
+        os.makedirs(cache_dir, exist_ok=True)
+        self.path = os.path.join(cache_dir, filename)
+        self.max_entries = max_entries
+
+        self._db = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        # Under WAL, NORMAL only syncs at checkpoints: still safe, and commits no longer block on fsync
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        # last_used is a use counter shared by every connection to the file, so LRU order
+        # never depends on clock resolution
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS responses "
+            "(key TEXT PRIMARY KEY, body BLOB NOT NULL, expires_at REAL NOT NULL, "
+            "last_used INTEGER NOT NULL DEFAULT 0)"
+        )
+        columns = {row[1] for row in self._db.execute("PRAGMA table_info(responses)")}
+        if "last_used" not in columns:  # database written before the LRU cap
+            self._db.execute("ALTER TABLE responses ADD COLUMN last_used INTEGER NOT NULL DEFAULT 0")
+        self._db.execute("CREATE INDEX IF NOT EXISTS responses_last_used ON responses (last_used)")
+        # Drop expired entries once per open rather than on every lookup
+        self._db.execute("DELETE FROM responses WHERE expires_at < ?", (time.time(),))
+
+    @staticmethod
+    def key(*parts: Any) -> str:
+        """Hash the JSON-serializable request parts (method, URL, payload) into a cache key"""
+        return hashlib.blake2b(_canonical(parts), digest_size=16).hexdigest()
+
+    def get(self, key: str) -> Optional[bytes]:
+        """Return the cached body for `key`, or None if it is missing or expired"""
+        row = self._db.execute(
+            "SELECT body FROM responses WHERE key = ? AND expires_at >= ?",
+            (key, time.time())
+        ).fetchone()
+        if row is None:
+            return None
+        self._db.execute(
+            f"UPDATE responses SET last_used = {_NEXT_USE} WHERE key = ?",
+            (key,)
+        )
+        return row[0]
+
+    def set(self, key: str, body: bytes, ttl: float) -> None:
+        """Store `body` under `key` for `ttl` seconds, evicting the least recently used entries past max_entries"""
+        self._db.execute(
+            f"INSERT OR REPLACE INTO responses (key, body, expires_at, last_used) VALUES (?, ?, ?, {_NEXT_USE})",
+            (key, body, time.time() + ttl)
+        )
+        # The subquery walks the last_used index to the oldest entry still within the cap; with
+        # max_entries or fewer rows it is NULL and nothing is deleted
+        self._db.execute(
+            "DELETE FROM responses WHERE last_used <= "
+            "(SELECT last_used FROM responses ORDER BY last_used DESC LIMIT 1 OFFSET ?)",
+            (self.max_entries,)
+        )
+
+    def close(self) -> None:
+        """Close the database connection"""
+        self._db.close()
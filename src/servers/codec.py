@@ -0,0 +1,43 @@
+"""
+JSON encoding and response parsing shared by the map servers
+Uses orjson when it is installed, falling back to the stdlib json module
+"""
+
+import asyncio
+from typing import Any
+import json
+
+try:
+    import orjson
+
+    loads = orjson.loads
+    dumps = orjson.dumps
+
+    def dump_result(result: Any) -> bytes:
+        """Serialize a tool result, including NumPy matrices, to JSON bytes"""
+        return orjson.dumps(result, option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS)
+except ImportError:  # fall back to the stdlib parser if orjson is not installed
+    loads = json.loads
+
+    def dumps(value: Any) -> bytes:
+        return json.dumps(value).encode()
+
+    def dump_result(result: Any) -> bytes:
+        """Serialize a tool result, including NumPy matrices, to JSON bytes"""
+        return json.dumps(result, default=lambda value: value.tolist()).encode()
+
+try:
+    import brotli  # noqa: F401 - httpx decodes "br" responses when brotli is installed
+    ACCEPT_ENCODING = "gzip, br"
+except ImportError:
+    ACCEPT_ENCODING = "gzip"
+
+# Response bodies at least this large are parsed off the event loop
+OFFLOAD_PARSE_BYTES = 64 * 1024
+
+
+async def parse_json(content: bytes) -> Any:
+    """Parse a JSON response body, in a worker thread when it is large enough to stall the event loop"""
+    if len(content) < OFFLOAD_PARSE_BYTES:
+        return loads(content)
+    return await asyncio.get_running_loop().run_in_executor(None, loads, content)
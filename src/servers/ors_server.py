@@ -5,18 +5,176 @@ Uses ORS API for routing, isochrones, and distance matrices
 
 import httpx
 import os
-from typing import Dict, Any, List, Optional
-from dataclasses import dataclass
-import json
+import asyncio
+import gzip
+import numpy as np
+from typing import Dict, Any, List, Optional, Sequence
+from dataclasses import dataclass, replace
+from functools import lru_cache
+from types import MappingProxyType
 
+from .cache import ResponseCache, resolve_cache_dir, ORS_TTL
+from .codec import ACCEPT_ENCODING, dump_result, dumps, parse_json
 
-@dataclass
+# Request bodies larger than this are gzipped when ServerParams.gzip_requests is set
+_GZIP_MIN_BYTES = 4096
+
+@lru_cache(maxsize=64)
+def _endpoint(base_url: str, service: str, *parts: str) -> str:
+    """Build an ORS v2 endpoint URL once per (base, service, profile, format) combination"""
+    return "/".join((base_url, "v2", service) + parts)
+
+
+# Shared read-only defaults for missing response fields, so the transforms don't allocate per item
+_EMPTY = ()
+_NO_SUMMARY = MappingProxyType({})
+_NO_SEGMENTS = (_NO_SUMMARY,)
+_NO_PROPS = _NO_SUMMARY
+
+# Immutable argument defaults, shared across calls instead of mutable list literals
+_DEFAULT_RANGES = (300, 600, 900)
+_DEFAULT_METRICS = ("distance", "duration")
+
+
+def _as_matrix(rows: Optional[List[List[Optional[float]]]]) -> Optional[np.ndarray]:
+    """Convert an ORS matrix to a float32 array (unreachable pairs come back as null and become NaN)"""
+    if rows is None:
+        return None
+    return np.asarray(rows, dtype=np.float32)
+
+
+@dataclass(frozen=True, slots=True)
 class ServerParams:
     """Configuration parameters for RouteMCP server"""
     ors_url: str = "https://api.openrouteservice.org"
     api_key: Optional[str] = None
     user_agent: str = "MapServersProject/1.0"
     timeout: int = 30
+    cache_dir: Optional[str] = None  # None: use MAP_CACHE_DIR or ~/.cache/mapmcp; "": disable
+    gzip_requests: bool = False  # gzip large POST bodies (many-location matrices/routes)
+
+
+# Shared default configuration (immutable, so one instance serves every server)
+_DEFAULT_PARAMS = ServerParams()
+
+
+# OpenAI function definitions for the ORS tools, built once at import
+_ORS_TOOL_DEFS: List[Dict[str, Any]] = [
+    {
+        "type": "function",
+        "function": {
+            "name": "ors_route",
+            "description": "Calculate optimal route between two or more points using OpenRouteService",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "coordinates": {
+                        "type": "array",
+                        "description": "List of [longitude, latitude] pairs (at least 2 points)",
+                        "items": {
+                            "type": "array",
+                            "items": {"type": "number"},
+                            "minItems": 2,
+                            "maxItems": 2
+                        },
+                        "minItems": 2
+                    },
+                    "profile": {
+                        "type": "string",
+                        "description": "Transportation mode",
+                        "enum": ["driving-car", "driving-hgv", "cycling-regular", "cycling-road", 
+                                "cycling-mountain", "cycling-electric", "foot-walking", "foot-hiking", 
+                                "wheelchair"],
+                        "default": "driving-car"
+                    },
+                    "instructions": {
+                        "type": "boolean",
+                        "description": "Include turn-by-turn instructions",
+                        "default": True
+                    }
+                },
+                "required": ["coordinates"]
+            }
+        }
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "ors_isochrone",
+            "description": "Calculate reachable areas within specified time or distance ranges using OpenRouteService",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "location": {
+                        "type": "array",
+                        "description": "Starting point [longitude, latitude]",
+                        "items": {"type": "number"},
+                        "minItems": 2,
+                        "maxItems": 2
+                    },
+                    "profile": {
+                        "type": "string",
+                        "description": "Transportation mode",
+                        "enum": ["driving-car", "driving-hgv", "cycling-regular", "foot-walking", "wheelchair"],
+                        "default": "driving-car"
+                    },
+                    "range_values": {
+                        "type": "array",
+                        "description": "List of time (seconds) or distance (meters) values",
+                        "items": {"type": "integer"},
+                        "default": [300, 600, 900]
+                    },
+                    "range_type": {
+                        "type": "string",
+                        "description": "Type of range calculation",
+                        "enum": ["time", "distance"],
+                        "default": "time"
+                    }
+                },
+                "required": ["location"]
+            }
+        }
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "ors_matrix",
+            "description": "Calculate distance and duration matrix between multiple points using OpenRouteService",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "locations": {
+                        "type": "array",
+                        "description": "List of [longitude, latitude] pairs (at least 2 points)",
+                        "items": {
+                            "type": "array",
+                            "items": {"type": "number"},
+                            "minItems": 2,
+                            "maxItems": 2
+                        },
+                        "minItems": 2
+                    },
+                    "profile": {
+                        "type": "string",
+                        "description": "Transportation mode",
+                        "enum": ["driving-car", "driving-hgv", "cycling-regular", "foot-walking"],
+                        "default": "driving-car"
+                    },
+                    "metrics": {
+                        "type": "array",
+                        "description": "Metrics to calculate",
+                        "items": {
+                            "type": "string",
+                            "enum": ["distance", "duration"]
+                        },
+                        "default": ["distance", "duration"]
+                    }
+                },
+                "required": ["locations"]
+            }
+        }
+    }
+]
 
 
 class RouteMCP:
@@ -27,30 +185,117 @@ class RouteMCP:
     1. route: Calculate optimal route between points
     2. isochrone: Calculate reachable areas within time/distance
     3. matrix: Calculate distance/time matrix between multiple points
+    
+    Use as an async context manager (`async with RouteMCP() as server:`) so the
+    HTTP client is closed before the event loop shuts down.
     """
     
-    def __init__(self, params: Optional[ServerParams] = None):
-        """Initialize ORS server with configuration parameters"""
-        self.params = params or ServerParams()
+    # Tool name -> method name, so execute_tool is a single dict lookup
+    _DISPATCH = {
+        "ors_route": "route",
+        "ors_isochrone": "isochrone",
+        "ors_matrix": "matrix"
+    }
+    
+    def __init__(
+        self,
+        params: Optional[ServerParams] = None,
+        client: Optional[httpx.AsyncClient] = None
+    ):
+        """Initialize ORS server with configuration parameters and an optional shared HTTP client"""
+        self.params = params or _DEFAULT_PARAMS
         
-        # Load API key from environment if not provided
+        # Load API key from environment if not provided; params are frozen, so overrides
+        # build a new instance and never touch the caller's (or the shared default) params
         if not self.params.api_key:
-            self.params.api_key = os.getenv("ORS_API_KEY")
+            self.params = replace(self.params, api_key=os.getenv("ORS_API_KEY"))
         
         if user_agent := os.getenv("USER_AGENT"):
-            self.params.user_agent = user_agent
+            self.params = replace(self.params, user_agent=user_agent)
         
-        self.headers = {
+        headers = {
             "User-Agent": self.params.user_agent,
+            "Accept-Encoding": ACCEPT_ENCODING,
             "Content-Type": "application/json"
         }
         
         if self.params.api_key:
-            self.headers["Authorization"] = self.params.api_key
+            headers["Authorization"] = self.params.api_key
+        
+        # Read-only, so it can be shared with every request without defensive copies
+        self.headers = MappingProxyType(headers)
+        self._gzip_headers = MappingProxyType({**headers, "Content-Encoding": "gzip"})
+        
+        # One long-lived client per server so connections are pooled across tool calls;
+        # HTTP/2 lets concurrent calls share one connection per host as multiplexed streams
+        self._owns_client = client is None
+        self._client = client if client is not None else httpx.AsyncClient(
+            http2=True,
+            limits=httpx.Limits(max_keepalive_connections=20, max_connections=50, keepalive_expiry=60.0),
+            timeout=self.params.timeout,
+            headers=self.headers
+        )
+        
+        # Caps in-flight requests so batched calls stay within the public API rate limits
+        self._sem = asyncio.Semaphore(int(os.getenv("ORS_CONCURRENCY", "4")))
+        
+        # Raw responses are cached on disk (MAP_CACHE_DIR, set it empty to disable)
+        cache_dir = resolve_cache_dir(self.params.cache_dir)
+        self._cache = ResponseCache(cache_dir) if cache_dir else None
+    
+    async def aclose(self):
+        """Close the response cache and the HTTP client if this server created it (an injected client is left open)"""
+        if self._owns_client:
+            await self._client.aclose()
+        if self._cache is not None:
+            self._cache.close()
+    
+    async def __aenter__(self):
+        return self
+    
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.aclose()
+    
+    async def warmup(self):
+        """
+        Open a connection to ORS ahead of the first tool call.
+        
+        Sends a HEAD request so the TCP/TLS handshake happens while the agent is idle.
+        Failures are ignored; the first real request just connects itself.
+        """
+        await asyncio.gather(
+            self._client.head(self.params.ors_url, headers=self.headers, timeout=self.params.timeout),
+            return_exceptions=True
+        )
+    
+    async def _post(self, url: str, payload: Dict[str, Any]) -> Any:
+        """POST a JSON payload and return the parsed response, served from the disk cache when possible"""
+        key = None
+        if self._cache is not None:
+            key = self._cache.key("POST", url, payload)
+            cached = self._cache.get(key)
+            if cached is not None:
+                return await parse_json(cached)
+        
+        # Serialize once with orjson; big bodies are optionally gzipped to cut upload size
+        body = dumps(payload)
+        headers = self.headers
+        if self.params.gzip_requests and len(body) > _GZIP_MIN_BYTES:
+            body = gzip.compress(body, compresslevel=6)
+            headers = self._gzip_headers
+        
+        async with self._sem:
+            response = await self._client.post(url, content=body, headers=headers, timeout=self.params.timeout)
+        response.raise_for_status()
+        content = await response.aread()
+        data = await parse_json(content)
+        if key is not None:
+            self._cache.set(key, content, ORS_TTL)
+        return data
     
     async def route(
         self,
-        coordinates: List[List[float]],
+        coordinates: Sequence[Sequence[float]],
         profile: str = "driving-car",
         format_type: str = "json",
         instructions: bool = True
@@ -59,7 +304,7 @@ class RouteMCP:
         Calculate optimal route between two or more points.
         
         Args:
-            coordinates: List of [lon, lat] pairs (at least 2 points)
+            coordinates: Sequence of [lon, lat] pairs, as lists or tuples (at least 2 points)
             profile: Transportation mode (driving-car, cycling-regular, foot-walking, etc.)
             format_type: Response format (json, geojson)
             instructions: Include turn-by-turn instructions
@@ -74,7 +319,7 @@ class RouteMCP:
         if len(coordinates) < 2:
             raise ValueError("At least 2 coordinates required for routing")
         
-        url = f"{self.params.ors_url}/v2/directions/{profile}/{format_type}"
+        url = _endpoint(self.params.ors_url, "directions", profile, format_type)
         
         payload = {
             "coordinates": coordinates,
@@ -82,20 +327,17 @@ class RouteMCP:
             "elevation": False
         }
         
-        async with httpx.AsyncClient(timeout=self.params.timeout) as client:
-            response = await client.post(url, json=payload, headers=self.headers)
-            response.raise_for_status()
-            data = response.json()
+        data = await self._post(url, payload)
         
         # Transform to MCP-compliant format
         routes = []
-        for route in data.get("routes", []):
-            summary = route.get("summary", {})
+        for route in data.get("routes", _EMPTY):
+            summary = route.get("summary") or _NO_SUMMARY
             routes.append({
                 "distance": summary.get("distance"),  # meters
                 "duration": summary.get("duration"),  # seconds
                 "geometry": route.get("geometry"),
-                "instructions": route.get("segments", [{}])[0].get("steps", []) if instructions else []
+                "instructions": (route.get("segments") or _NO_SEGMENTS)[0].get("steps", _EMPTY) if instructions else _EMPTY
             })
         
         return {
@@ -107,9 +349,9 @@ class RouteMCP:
     
     async def isochrone(
         self,
-        location: List[float],
+        location: Sequence[float],
         profile: str = "driving-car",
-        range_values: List[int] = [300, 600, 900],
+        range_values: Optional[List[int]] = None,
         range_type: str = "time"
     ) -> Dict[str, Any]:
         """
@@ -118,7 +360,7 @@ class RouteMCP:
         Args:
             location: Starting point [lon, lat]
             profile: Transportation mode
-            range_values: List of time (seconds) or distance (meters) values
+            range_values: List of time (seconds) or distance (meters) values (default: 300, 600, 900)
             range_type: Type of range ("time" or "distance")
         
         Returns:
@@ -128,7 +370,10 @@ class RouteMCP:
             >>> result = await ors.isochrone([2.3522, 48.8566], range_values=[300, 600])
             >>> print(f"Found {len(result['isochrones'])} isochrone polygons")
         """
-        url = f"{self.params.ors_url}/v2/isochrones/{profile}"
+        if range_values is None:
+            range_values = _DEFAULT_RANGES
+        
+        url = _endpoint(self.params.ors_url, "isochrones", profile)
         
         payload = {
             "locations": [location],
@@ -136,15 +381,12 @@ class RouteMCP:
             "range_type": range_type
         }
         
-        async with httpx.AsyncClient(timeout=self.params.timeout) as client:
-            response = await client.post(url, json=payload, headers=self.headers)
-            response.raise_for_status()
-            data = response.json()
+        data = await self._post(url, payload)
         
         # Transform to MCP-compliant format
         isochrones = []
-        for feature in data.get("features", []):
-            props = feature.get("properties", {})
+        for feature in data.get("features", _EMPTY):
+            props = feature.get("properties") or _NO_PROPS
             isochrones.append({
                 "value": props.get("value"),
                 "range_type": range_type,
@@ -162,34 +404,41 @@ class RouteMCP:
     
     async def matrix(
         self,
-        locations: List[List[float]],
+        locations: Sequence[Sequence[float]],
         profile: str = "driving-car",
-        metrics: List[str] = ["distance", "duration"],
+        metrics: Optional[List[str]] = None,
         sources: Optional[List[int]] = None,
-        destinations: Optional[List[int]] = None
+        destinations: Optional[List[int]] = None,
+        as_numpy: bool = True
     ) -> Dict[str, Any]:
         """
         Calculate distance and/or duration matrix between multiple points.
         
         Args:
-            locations: List of [lon, lat] pairs
+            locations: Sequence of [lon, lat] pairs, as lists or tuples
             profile: Transportation mode
-            metrics: List of metrics to calculate ("distance", "duration")
+            metrics: List of metrics to calculate (default: "distance" and "duration")
             sources: Indices of source locations (default: all)
             destinations: Indices of destination locations (default: all)
+            as_numpy: Return the matrices as float32 NumPy arrays (default: True);
+                set to False for the nested lists exactly as ORS sent them
         
         Returns:
-            JSON response with distance/duration matrices
+            JSON response with distance/duration matrices (None for metrics not requested;
+            unreachable pairs are NaN in arrays and None in lists)
         
         Example:
             >>> locs = [[2.3522, 48.8566], [2.2945, 48.8584], [2.3488, 48.8534]]
             >>> result = await ors.matrix(locs)
-            >>> print(result['durations'])  # matrix of durations in seconds
+            >>> print(result['durations'].argmin(axis=1))  # nearest destination per source
         """
         if len(locations) < 2:
             raise ValueError("At least 2 locations required for matrix calculation")
         
-        url = f"{self.params.ors_url}/v2/matrix/{profile}"
+        if metrics is None:
+            metrics = _DEFAULT_METRICS
+        
+        url = _endpoint(self.params.ors_url, "matrix", profile)
         
         payload = {
             "locations": locations,
@@ -201,151 +450,83 @@ class RouteMCP:
         if destinations is not None:
             payload["destinations"] = destinations
         
-        async with httpx.AsyncClient(timeout=self.params.timeout) as client:
-            response = await client.post(url, json=payload, headers=self.headers)
-            response.raise_for_status()
-            data = response.json()
+        data = await self._post(url, payload)
+        
+        durations = data.get("durations")
+        distances = data.get("distances")
+        if as_numpy:
+            # Convert once here so callers can use vectorized min/argmin instead of nested loops
+            durations = _as_matrix(durations)
+            distances = _as_matrix(distances)
         
         return {
             "operation": "matrix",
             "profile": profile,
             "locations": locations,
-            "durations": data.get("durations"),  # 2D array in seconds
-            "distances": data.get("distances")   # 2D array in meters
+            "durations": durations,  # 2D array in seconds
+            "distances": distances   # 2D array in meters
         }
     
-    def get_tool_definitions(self) -> List[Dict[str, Any]]:
+    async def route_many(self, requests: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        Calculate several routes concurrently (bounded by ORS_CONCURRENCY).
+        
+        Args:
+            requests: Keyword arguments for each route call
+        
+        Returns:
+            One route response per entry, in the same order
+        
+        Example:
+            >>> results = await ors.route_many([
+            ...     {"coordinates": [[2.3522, 48.8566], [2.2945, 48.8584]]},
+            ...     {"coordinates": [[2.3522, 48.8566], [2.3376, 48.8606]], "profile": "foot-walking"},
+            ... ])
+        """
+        return await asyncio.gather(*(self.route(**request) for request in requests))
+    
+    async def isochrone_many(self, requests: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        Calculate several isochrones concurrently (bounded by ORS_CONCURRENCY).
+        
+        Args:
+            requests: Keyword arguments for each isochrone call
+        
+        Returns:
+            One isochrone response per entry, in the same order
+        
+        Example:
+            >>> results = await ors.isochrone_many([
+            ...     {"location": [2.3522, 48.8566], "range_values": [300]},
+            ...     {"location": [2.2945, 48.8584], "range_values": [300]},
+            ... ])
+        """
+        return await asyncio.gather(*(self.isochrone(**request) for request in requests))
+    
+    @staticmethod
+    def get_tool_definitions() -> List[Dict[str, Any]]:
         """
         Get OpenAI function definitions for all ORS tools.
         Used by the agent to understand available operations.
+        Tool schemas are static, so this can be called on the class; the returned
+        list is shared, so callers must not mutate it.
         """
-        return [
-            {
-                "type": "function",
-                "function": {
-                    "name": "ors_route",
-                    "description": "Calculate optimal route between two or more points using OpenRouteService",
-                    "parameters": {
-                        "type": "object",
-                        "properties": {
-                            "coordinates": {
-                                "type": "array",
-                                "description": "List of [longitude, latitude] pairs (at least 2 points)",
-                                "items": {
-                                    "type": "array",
-                                    "items": {"type": "number"},
-                                    "minItems": 2,
-                                    "maxItems": 2
-                                },
-                                "minItems": 2
-                            },
-                            "profile": {
-                                "type": "string",
-                                "description": "Transportation mode",
-                                "enum": ["driving-car", "driving-hgv", "cycling-regular", "cycling-road", 
-                                        "cycling-mountain", "cycling-electric", "foot-walking", "foot-hiking", 
-                                        "wheelchair"],
-                                "default": "driving-car"
-                            },
-                            "instructions": {
-                                "type": "boolean",
-                                "description": "Include turn-by-turn instructions",
-                                "default": True
-                            }
-                        },
-                        "required": ["coordinates"]
-                    }
-                }
-            },
-            {
-                "type": "function",
-                "function": {
-                    "name": "ors_isochrone",
-                    "description": "Calculate reachable areas within specified time or distance ranges using OpenRouteService",
-                    "parameters": {
-                        "type": "object",
-                        "properties": {
-                            "location": {
-                                "type": "array",
-                                "description": "Starting point [longitude, latitude]",
-                                "items": {"type": "number"},
-                                "minItems": 2,
-                                "maxItems": 2
-                            },
-                            "profile": {
-                                "type": "string",
-                                "description": "Transportation mode",
-                                "enum": ["driving-car", "driving-hgv", "cycling-regular", "foot-walking", "wheelchair"],
-                                "default": "driving-car"
-                            },
-                            "range_values": {
-                                "type": "array",
-                                "description": "List of time (seconds) or distance (meters) values",
-                                "items": {"type": "integer"},
-                                "default": [300, 600, 900]
-                            },
-                            "range_type": {
-                                "type": "string",
-                                "description": "Type of range calculation",
-                                "enum": ["time", "distance"],
-                                "default": "time"
-                            }
-                        },
-                        "required": ["location"]
-                    }
-                }
-            },
-            {
-                "type": "function",
-                "function": {
-                    "name": "ors_matrix",
-                    "description": "Calculate distance and duration matrix between multiple points using OpenRouteService",
-                    "parameters": {
-                        "type": "object",
-                        "properties": {
-                            "locations": {
-                                "type": "array",
-                                "description": "List of [longitude, latitude] pairs (at least 2 points)",
-                                "items": {
-                                    "type": "array",
-                                    "items": {"type": "number"},
-                                    "minItems": 2,
-                                    "maxItems": 2
-                                },
-                                "minItems": 2
-                            },
-                            "profile": {
-                                "type": "string",
-                                "description": "Transportation mode",
-                                "enum": ["driving-car", "driving-hgv", "cycling-regular", "foot-walking"],
-                                "default": "driving-car"
-                            },
-                            "metrics": {
-                                "type": "array",
-                                "description": "Metrics to calculate",
-                                "items": {
-                                    "type": "string",
-                                    "enum": ["distance", "duration"]
-                                },
-                                "default": ["distance", "duration"]
-                            }
-                        },
-                        "required": ["locations"]
-                    }
-                }
-            }
-        ]
+        return _ORS_TOOL_DEFS
     
     async def execute_tool(self, tool_name: str, arguments: Dict[str, Any]) -> Dict[str, Any]:
         """
         Execute a tool by name with given arguments.
         Used by the agent to dispatch tool calls.
         """
-        if tool_name == "ors_route":
-            return await self.route(**arguments)
-        elif tool_name == "ors_isochrone":
-            return await self.isochrone(**arguments)
-        elif tool_name == "ors_matrix":
-            return await self.matrix(**arguments)
-        else:
-            raise ValueError(f"Unknown tool: {tool_name}")
+        try:
+            method = getattr(self, self._DISPATCH[tool_name])
+        except KeyError:
+            raise ValueError(f"Unknown tool: {tool_name}") from None
+        return await method(**arguments)
+    
+    async def execute_tool_bytes(self, tool_name: str, arguments: Dict[str, Any]) -> bytes:
+        """
+        Execute a tool and return its result already serialized to JSON.
+        Lets the caller forward the bytes as-is instead of encoding the result dict again.
+        """
+        return dump_result(await self.execute_tool(tool_name, arguments))
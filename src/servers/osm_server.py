@@ -6,18 +6,187 @@ Uses Nominatim (geocoding) and Overpass (POI search) APIs
 import httpx
 import os
 import asyncio
+import re
+import time
 from typing import Dict, Any, List, Optional
-from dataclasses import dataclass
-import json
+from dataclasses import dataclass, replace
+from functools import lru_cache
+from types import MappingProxyType
 
+from .cache import ResponseCache, resolve_cache_dir, NOMINATIM_TTL, OVERPASS_TTL
+from .codec import ACCEPT_ENCODING, dump_result, parse_json
 
-@dataclass
+
+@dataclass(frozen=True, slots=True)
 class ServerParams:
     """Configuration parameters for OSMGeoMCP server"""
     nominatim_url: str = "https://nominatim.openstreetmap.org"
     overpass_url: str = "https://overpass-api.de/api/interpreter"
     user_agent: str = "MapServersProject/1.0"
     timeout: int = 30
+    cache_dir: Optional[str] = None  # None: use MAP_CACHE_DIR or ~/.cache/mapmcp; "": disable
+    nominatim_interval: float = 1.0  # min seconds between Nominatim request starts (usage policy: 1/s)
+
+
+# Shared default configuration (immutable, so one instance serves every server)
+_DEFAULT_PARAMS = ServerParams()
+
+
+# Plain amenity values ("cafe", "fast_food") can use an exact tag match instead of a regex scan
+_PLAIN_AMENITY = re.compile(r"^[a-z_]+$")
+
+
+def _amenity_filter(query: str) -> str:
+    """
+    Build the Overpass tag filter for an amenity query.
+    
+    Plain values get an exact `=` match so Overpass can use its tag index; anything
+    else (e.g. "cafe|bar") is kept as a case-insensitive regex. Quotes and backslashes
+    are escaped so the query cannot break out of the QL string.
+    """
+    value = query.replace("\\", "\\\\").replace('"', '\\"')
+    if _PLAIN_AMENITY.match(query):
+        return f'["amenity"="{value}"]'
+    return f'["amenity"~"{value}",i]'
+
+
+@lru_cache(maxsize=256)
+def _poi_template(query: str, radius: int) -> str:
+    """
+    Overpass QL for an amenity search, with {lat}, {lon} and {limit} left as format fields.
+    
+    Memoized per (query, radius), so repeated searches only fill in the center and limit.
+    """
+    amenity = _amenity_filter(query).replace("{", "{{").replace("}", "}}")
+    around = f"(around:{radius},{{lat}},{{lon}});"
+    return (
+        "[out:json][timeout:25];("
+        f"node{amenity}{around}"
+        f"way{amenity}{around}"
+        f"relation{amenity}{around}"
+        ");out center {limit};"
+    )
+
+
+def _filter_pois(elements: List[Dict[str, Any]], limit: int) -> List[Dict[str, Any]]:
+    """
+    Transform Overpass elements into POI results, keeping at most `limit`.
+    
+    Nodes carry their own coordinates; ways and relations use their center and
+    are skipped without one. Locals are bound once since this loop runs per element.
+    """
+    results = []
+    append = results.append
+    for element in elements:
+        # Overpass already caps output at `limit`; stop early in case a mirror ignores it
+        if len(results) >= limit:
+            break
+        
+        # Get coordinates (center for ways/relations)
+        if element["type"] == "node":
+            point = element
+        else:
+            point = element.get("center")
+            if point is None:
+                continue
+        
+        tags = element.get("tags") or {}
+        append({
+            "name": tags.get("name", "Unnamed"),
+            "type": tags.get("amenity"),
+            "lat": point["lat"],
+            "lon": point["lon"],
+            "tags": tags
+        })
+    return results
+
+
+# OpenAI function definitions for the OSM tools, built once at import
+_OSM_TOOL_DEFS: List[Dict[str, Any]] = [
+    {
+        "type": "function",
+        "function": {
+            "name": "osm_forward_geocode",
+            "description": "Convert an address or place name to geographic coordinates using OpenStreetMap",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "query": {
+                        "type": "string",
+                        "description": "Address or place name to geocode"
+                    },
+                    "limit": {
+                        "type": "integer",
+                        "description": "Maximum number of results (default: 5)",
+                        "default": 5
+                    }
+                },
+                "required": ["query"]
+            }
+        }
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "osm_reverse_geocode",
+            "description": "Convert geographic coordinates to an address using OpenStreetMap",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "lat": {
+                        "type": "number",
+                        "description": "Latitude"
+                    },
+                    "lon": {
+                        "type": "number",
+                        "description": "Longitude"
+                    },
+                    "zoom": {
+                        "type": "integer",
+                        "description": "Level of detail (0-18, higher = more detailed, default: 18)",
+                        "default": 18
+                    }
+                },
+                "required": ["lat", "lon"]
+            }
+        }
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "osm_poi_search",
+            "description": "Search for points of interest (POIs) near a location using OpenStreetMap Overpass API",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "query": {
+                        "type": "string",
+                        "description": "Type of POI (e.g., 'restaurant', 'hospital', 'cafe', 'school')"
+                    },
+                    "lat": {
+                        "type": "number",
+                        "description": "Center latitude"
+                    },
+                    "lon": {
+                        "type": "number",
+                        "description": "Center longitude"
+                    },
+                    "radius": {
+                        "type": "integer",
+                        "description": "Search radius in meters (default: 1000)",
+                        "default": 1000
+                    },
+                    "limit": {
+                        "type": "integer",
+                        "description": "Maximum number of results (default: 20)",
+                        "default": 20
+                    }
+                },
+                "required": ["query", "lat", "lon"]
+            }
+        }
+    }
+]
 
 
 class OSMGeoMCP:
@@ -28,17 +197,129 @@ class OSMGeoMCP:
     1. forward_geocode: Convert address to coordinates
     2. reverse_geocode: Convert coordinates to address
     3. poi_search: Search for points of interest
+    
+    Use as an async context manager (`async with OSMGeoMCP() as server:`) so the
+    HTTP client is closed before the event loop shuts down.
     """
     
-    def __init__(self, params: Optional[ServerParams] = None):
-        """Initialize OSM server with configuration parameters"""
-        self.params = params or ServerParams()
+    # Tool name -> method name, so execute_tool is a single dict lookup
+    _DISPATCH = {
+        "osm_forward_geocode": "forward_geocode",
+        "osm_reverse_geocode": "reverse_geocode",
+        "osm_poi_search": "poi_search"
+    }
+    
+    def __init__(
+        self,
+        params: Optional[ServerParams] = None,
+        client: Optional[httpx.AsyncClient] = None
+    ):
+        """Initialize OSM server with configuration parameters and an optional shared HTTP client"""
+        self.params = params or _DEFAULT_PARAMS
+        # Params are frozen, so the override builds a new instance and never touches
+        # the caller's (or the shared default) params
         if user_agent := os.getenv("USER_AGENT"):
-            self.params.user_agent = user_agent
+            self.params = replace(self.params, user_agent=user_agent)
         
-        self.headers = {
-            "User-Agent": self.params.user_agent
-        }
+        # Read-only, so it can be shared with every request without defensive copies
+        self.headers = MappingProxyType({
+            "User-Agent": self.params.user_agent,
+            "Accept-Encoding": ACCEPT_ENCODING
+        })
+        
+        # Endpoint URLs are fixed per instance, so build them once
+        self._search_url = f"{self.params.nominatim_url}/search"
+        self._reverse_url = f"{self.params.nominatim_url}/reverse"
+        
+        # One long-lived client per server so connections are pooled across tool calls;
+        # HTTP/2 lets concurrent calls share one connection per host as multiplexed streams
+        self._owns_client = client is None
+        self._client = client if client is not None else httpx.AsyncClient(
+            http2=True,
+            limits=httpx.Limits(max_keepalive_connections=20, max_connections=50, keepalive_expiry=60.0),
+            timeout=self.params.timeout,
+            headers=self.headers
+        )
+        
+        # Caps in-flight requests; this bounds concurrency only, not requests per second
+        self._sem = asyncio.Semaphore(int(os.getenv("OSM_CONCURRENCY", "4")))
+        
+        # Nominatim allows 1 request per second, so request starts are spaced out separately
+        # Tests swap the clock and sleep for fakes to check the spacing without waiting
+        self._nominatim_lock = asyncio.Lock()
+        self._nominatim_next = 0.0
+        self._clock = time.monotonic
+        self._sleep = asyncio.sleep
+        
+        # Raw responses are cached on disk (MAP_CACHE_DIR, set it empty to disable)
+        cache_dir = resolve_cache_dir(self.params.cache_dir)
+        self._cache = ResponseCache(cache_dir) if cache_dir else None
+    
+    async def aclose(self):
+        """Close the response cache and the HTTP client if this server created it (an injected client is left open)"""
+        if self._owns_client:
+            await self._client.aclose()
+        if self._cache is not None:
+            self._cache.close()
+    
+    async def __aenter__(self):
+        return self
+    
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.aclose()
+    
+    async def warmup(self):
+        """
+        Open connections to Nominatim and Overpass ahead of the first tool call.
+        
+        Sends a HEAD request to each host so the TCP/TLS handshake happens while the
+        agent is idle. Failures are ignored; the first real request just connects itself.
+        The Nominatim HEAD counts against its request spacing like any other call.
+        """
+        await asyncio.gather(
+            self._warmup_nominatim(),
+            self._client.head(self.params.overpass_url, headers=self.headers, timeout=self.params.timeout),
+            return_exceptions=True
+        )
+    
+    async def _warmup_nominatim(self):
+        await self._wait_nominatim_slot()
+        await self._client.head(self.params.nominatim_url, headers=self.headers, timeout=self.params.timeout)
+    
+    async def _wait_nominatim_slot(self):
+        """Wait until nominatim_interval seconds have passed since the previous Nominatim request started"""
+        async with self._nominatim_lock:
+            delay = self._nominatim_next - self._clock()
+            if delay > 0:
+                await self._sleep(delay)
+            self._nominatim_next = self._clock() + self.params.nominatim_interval
+    
+    async def _fetch(self, method: str, url: str, ttl: float, rate_limited: bool = False, **kwargs) -> Any:
+        """
+        Send a request and return the parsed JSON body, served from the disk cache when possible.
+        With rate_limited=True, requests that miss the cache are spaced by nominatim_interval.
+        """
+        key = None
+        if self._cache is not None:
+            key = self._cache.key(method, url, kwargs)
+            body = self._cache.get(key)
+            if body is not None:
+                return await parse_json(body)
+        
+        # Wait outside the semaphore so throttled Nominatim calls don't hold up Overpass
+        if rate_limited:
+            await self._wait_nominatim_slot()
+        
+        async with self._sem:
+            response = await self._client.request(
+                method, url, headers=self.headers, timeout=self.params.timeout, **kwargs
+            )
+        response.raise_for_status()
+        content = await response.aread()
+        data = await parse_json(content)
+        if key is not None:
+            self._cache.set(key, content, ttl)
+        return data
     
     async def forward_geocode(self, query: str, limit: int = 5) -> Dict[str, Any]:
         """
@@ -55,7 +336,7 @@ class OSMGeoMCP:
             >>> result = await osm.forward_geocode("Eiffel Tower, Paris")
             >>> print(result['results'][0]['lat'], result['results'][0]['lon'])
         """
-        url = f"{self.params.nominatim_url}/search"
+        url = self._search_url
         params = {
             "q": query,
             "format": "json",
@@ -63,17 +344,15 @@ class OSMGeoMCP:
             "addressdetails": 1
         }
         
-        async with httpx.AsyncClient(timeout=self.params.timeout) as client:
-            response = await client.get(url, params=params, headers=self.headers)
-            response.raise_for_status()
-            data = response.json()
+        data = await self._fetch("GET", url, NOMINATIM_TTL, rate_limited=True, params=params)
         
-        # Transform to MCP-compliant format
+        # Transform to MCP-compliant format; Nominatim returns coordinates as strings and
+        # float() beats a NumPy bulk parse at these sizes (limit is at most 50)
         results = [
             {
                 "display_name": item.get("display_name"),
-                "lat": float(item.get("lat")),
-                "lon": float(item.get("lon")),
+                "lat": float(item["lat"]),
+                "lon": float(item["lon"]),
                 "importance": item.get("importance"),
                 "address": item.get("address", {})
             }
@@ -103,7 +382,7 @@ class OSMGeoMCP:
             >>> result = await osm.reverse_geocode(48.8584, 2.2945)
             >>> print(result['address']['display_name'])
         """
-        url = f"{self.params.nominatim_url}/reverse"
+        url = self._reverse_url
         params = {
             "lat": lat,
             "lon": lon,
@@ -112,10 +391,7 @@ class OSMGeoMCP:
             "addressdetails": 1
         }
         
-        async with httpx.AsyncClient(timeout=self.params.timeout) as client:
-            response = await client.get(url, params=params, headers=self.headers)
-            response.raise_for_status()
-            data = response.json()
+        data = await self._fetch("GET", url, NOMINATIM_TTL, rate_limited=True, params=params)
         
         return {
             "operation": "reverse_geocode",
@@ -153,15 +429,7 @@ class OSMGeoMCP:
             >>> print(len(result['results']))
         """
         # Overpass QL query to search for amenities
-        overpass_query = f"""
-        [out:json][timeout:25];
-        (
-          node["amenity"~"{query}",i](around:{radius},{lat},{lon});
-          way["amenity"~"{query}",i](around:{radius},{lat},{lon});
-          relation["amenity"~"{query}",i](around:{radius},{lat},{lon});
-        );
-        out center {limit};
-        """
+        overpass_query = _poi_template(query, radius).format(lat=lat, lon=lon, limit=limit)
         
         # Retry logic for handling temporary server issues
         max_retries = 3
@@ -169,14 +437,12 @@ class OSMGeoMCP:
         
         for attempt in range(max_retries):
             try:
-                async with httpx.AsyncClient(timeout=self.params.timeout) as client:
-                    response = await client.post(
-                        self.params.overpass_url,
-                        data={"data": overpass_query},
-                        headers=self.headers
-                    )
-                    response.raise_for_status()
-                    data = response.json()
+                data = await self._fetch(
+                    "POST",
+                    self.params.overpass_url,
+                    OVERPASS_TTL,
+                    data={"data": overpass_query}
+                )
                 break  # Success, exit retry loop
             except (httpx.HTTPStatusError, httpx.TimeoutException) as e:
                 if attempt < max_retries - 1:
@@ -187,27 +453,7 @@ class OSMGeoMCP:
                     # Last attempt failed, raise the error
                     raise
         
-        # Transform results
-        results = []
-        for element in data.get("elements", []):
-            # Get coordinates (center for ways/relations)
-            if element["type"] == "node":
-                poi_lat = element["lat"]
-                poi_lon = element["lon"]
-            elif "center" in element:
-                poi_lat = element["center"]["lat"]
-                poi_lon = element["center"]["lon"]
-            else:
-                continue
-            
-            tags = element.get("tags", {})
-            results.append({
-                "name": tags.get("name", "Unnamed"),
-                "type": tags.get("amenity"),
-                "lat": poi_lat,
-                "lon": poi_lon,
-                "tags": tags
-            })
+        results = _filter_pois(data.get("elements", ()), limit)
         
         return {
             "operation": "poi_search",
@@ -218,107 +464,66 @@ class OSMGeoMCP:
             "results": results
         }
     
-    def get_tool_definitions(self) -> List[Dict[str, Any]]:
+    async def forward_geocode_many(self, queries: List[str], limit: int = 5) -> List[Dict[str, Any]]:
+        """
+        Geocode several addresses concurrently (bounded by OSM_CONCURRENCY).
+        Uncached lookups still start at most one per nominatim_interval.
+        
+        Args:
+            queries: Addresses or place names to geocode
+            limit: Maximum number of results per query (default: 5)
+        
+        Returns:
+            One forward_geocode response per query, in the same order
+        
+        Example:
+            >>> results = await osm.forward_geocode_many(["Eiffel Tower", "Louvre Museum"])
+            >>> print([r['count'] for r in results])
+        """
+        return await asyncio.gather(*(self.forward_geocode(query, limit=limit) for query in queries))
+    
+    async def poi_search_many(self, searches: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        Run several POI searches concurrently (bounded by OSM_CONCURRENCY).
+        
+        Args:
+            searches: Keyword arguments for each poi_search call
+        
+        Returns:
+            One poi_search response per entry, in the same order
+        
+        Example:
+            >>> results = await osm.poi_search_many([
+            ...     {"query": "cafe", "lat": 48.8584, "lon": 2.2945},
+            ...     {"query": "cafe", "lat": 48.8606, "lon": 2.3376},
+            ... ])
+        """
+        return await asyncio.gather(*(self.poi_search(**search) for search in searches))
+    
+    @staticmethod
+    def get_tool_definitions() -> List[Dict[str, Any]]:
         """
         Get OpenAI function definitions for all OSM tools.
         Used by the agent to understand available operations.
+        Tool schemas are static, so this can be called on the class; the returned
+        list is shared, so callers must not mutate it.
         """
-        return [
-            {
-                "type": "function",
-                "function": {
-                    "name": "osm_forward_geocode",
-                    "description": "Convert an address or place name to geographic coordinates using OpenStreetMap",
-                    "parameters": {
-                        "type": "object",
-                        "properties": {
-                            "query": {
-                                "type": "string",
-                                "description": "Address or place name to geocode"
-                            },
-                            "limit": {
-                                "type": "integer",
-                                "description": "Maximum number of results (default: 5)",
-                                "default": 5
-                            }
-                        },
-                        "required": ["query"]
-                    }
-                }
-            },
-            {
-                "type": "function",
-                "function": {
-                    "name": "osm_reverse_geocode",
-                    "description": "Convert geographic coordinates to an address using OpenStreetMap",
-                    "parameters": {
-                        "type": "object",
-                        "properties": {
-                            "lat": {
-                                "type": "number",
-                                "description": "Latitude"
-                            },
-                            "lon": {
-                                "type": "number",
-                                "description": "Longitude"
-                            },
-                            "zoom": {
-                                "type": "integer",
-                                "description": "Level of detail (0-18, higher = more detailed, default: 18)",
-                                "default": 18
-                            }
-                        },
-                        "required": ["lat", "lon"]
-                    }
-                }
-            },
-            {
-                "type": "function",
-                "function": {
-                    "name": "osm_poi_search",
-                    "description": "Search for points of interest (POIs) near a location using OpenStreetMap Overpass API",
-                    "parameters": {
-                        "type": "object",
-                        "properties": {
-                            "query": {
-                                "type": "string",
-                                "description": "Type of POI (e.g., 'restaurant', 'hospital', 'cafe', 'school')"
-                            },
-                            "lat": {
-                                "type": "number",
-                                "description": "Center latitude"
-                            },
-                            "lon": {
-                                "type": "number",
-                                "description": "Center longitude"
-                            },
-                            "radius": {
-                                "type": "integer",
-                                "description": "Search radius in meters (default: 1000)",
-                                "default": 1000
-                            },
-                            "limit": {
-                                "type": "integer",
-                                "description": "Maximum number of results (default: 20)",
-                                "default": 20
-                            }
-                        },
-                        "required": ["query", "lat", "lon"]
-                    }
-                }
-            }
-        ]
+        return _OSM_TOOL_DEFS
     
     async def execute_tool(self, tool_name: str, arguments: Dict[str, Any]) -> Dict[str, Any]:
         """
         Execute a tool by name with given arguments.
         Used by the agent to dispatch tool calls.
         """
-        if tool_name == "osm_forward_geocode":
-            return await self.forward_geocode(**arguments)
-        elif tool_name == "osm_reverse_geocode":
-            return await self.reverse_geocode(**arguments)
-        elif tool_name == "osm_poi_search":
-            return await self.poi_search(**arguments)
-        else:
-            raise ValueError(f"Unknown tool: {tool_name}")
+        try:
+            method = getattr(self, self._DISPATCH[tool_name])
+        except KeyError:
+            raise ValueError(f"Unknown tool: {tool_name}") from None
+        return await method(**arguments)
+    
+    async def execute_tool_bytes(self, tool_name: str, arguments: Dict[str, Any]) -> bytes:
+        """
+        Execute a tool and return its result already serialized to JSON.
+        Lets the caller forward the bytes as-is instead of encoding the result dict again.
+        """
+        return dump_result(await self.execute_tool(tool_name, arguments))
@@ -0,0 +1,90 @@
+"""
+Typed argument schemas for every map server tool
+Decodes the JSON arguments an LLM sends with a tool call straight into validated structs
+"""
+
+from typing import Any, Dict, List, Tuple, Union
+import msgspec
+from msgspec import UNSET, UnsetType
+
+
+class ForwardGeocodeArgs(msgspec.Struct):
+    """Arguments for osm_forward_geocode"""
+    query: str
+    limit: Union[int, UnsetType] = UNSET
+
+
+class ReverseGeocodeArgs(msgspec.Struct):
+    """Arguments for osm_reverse_geocode"""
+    lat: float
+    lon: float
+    zoom: Union[int, UnsetType] = UNSET
+
+
+class PoiSearchArgs(msgspec.Struct):
+    """Arguments for osm_poi_search"""
+    query: str
+    lat: float
+    lon: float
+    radius: Union[int, UnsetType] = UNSET
+    limit: Union[int, UnsetType] = UNSET
+
+
+class RouteArgs(msgspec.Struct):
+    """Arguments for ors_route"""
+    coordinates: List[Tuple[float, float]]
+    profile: Union[str, UnsetType] = UNSET
+    instructions: Union[bool, UnsetType] = UNSET
+
+
+class IsochroneArgs(msgspec.Struct):
+    """Arguments for ors_isochrone"""
+    location: Tuple[float, float]
+    profile: Union[str, UnsetType] = UNSET
+    range_values: Union[List[int], UnsetType] = UNSET
+    range_type: Union[str, UnsetType] = UNSET
+
+
+class MatrixArgs(msgspec.Struct):
+    """Arguments for ors_matrix"""
+    locations: List[Tuple[float, float]]
+    profile: Union[str, UnsetType] = UNSET
+    metrics: Union[List[str], UnsetType] = UNSET
+
+
+# One decoder per tool, built once at import
+DECODERS = {
+    "osm_forward_geocode": msgspec.json.Decoder(ForwardGeocodeArgs),
+    "osm_reverse_geocode": msgspec.json.Decoder(ReverseGeocodeArgs),
+    "osm_poi_search": msgspec.json.Decoder(PoiSearchArgs),
+    "ors_route": msgspec.json.Decoder(RouteArgs),
+    "ors_isochrone": msgspec.json.Decoder(IsochroneArgs),
+    "ors_matrix": msgspec.json.Decoder(MatrixArgs),
+}
+
+
+def decode_arguments(tool_name: str, raw: Union[str, bytes]) -> Dict[str, Any]:
+    """
+    Decode and validate the raw JSON arguments of a tool call.
+
+    Arguments the model left out are omitted from the result, so the server
+    method's own defaults apply.
+
+    Raises:
+        ValueError: If the tool is unknown or the arguments are malformed
+            or do not match the tool schema
+    """
+    decoder = DECODERS.get(tool_name)
+    if decoder is None:
+        raise ValueError(f"Unknown tool: {tool_name}")
+
+    try:
+        args = decoder.decode(raw)
+    except msgspec.DecodeError as e:
+        raise ValueError(f"Invalid arguments for {tool_name}: {e}") from e
+
+    return {
+        field: value
+        for field, value in msgspec.structs.asdict(args).items()
+        if value is not UNSET
+    }
@@ -0,0 +1,147 @@
+"""
+Shared pytest configuration for the map server tests
+Puts src/ on the path, injects a hermetic environment, and provides session-wide server fixtures
+"""
+
+import os
+import sys
+import fastjsonschema
+import httpx
+import pytest
+import respx
+
+try:
+    import uvloop
+except ImportError:  # uvloop does not support Windows; fall back to the default loop
+    uvloop = None
+
+# Add src to path (once, for every test module)
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from servers.osm_server import OSMGeoMCP, ServerParams as OSMParams  # noqa: E402
+from servers.ors_server import RouteMCP, ServerParams as ORSParams  # noqa: E402
+
+# OpenAI function-tool shape every server's get_tool_definitions() must follow, compiled once
+validate_tool_definitions = fastjsonschema.compile({
+    "type": "array",
+    "items": {
+        "type": "object",
+        "required": ["type", "function"],
+        "properties": {
+            "type": {"const": "function"},
+            "function": {
+                "type": "object",
+                "required": ["name", "description", "parameters"],
+                "properties": {
+                    "name": {"type": "string"},
+                    "description": {"type": "string"},
+                    "parameters": {
+                        "type": "object",
+                        "required": ["type", "properties", "required"],
+                        "properties": {"type": {"const": "object"}}
+                    }
+                }
+            }
+        }
+    }
+})
+
+def pytest_configure(config):
+    # Skip the .pytest_cache writes locally; CI=1 keeps them (and --lf/--ff/--nf/--sw).
+    # The cache plugin has already configured itself by now, so also drop the
+    # plugins it registered that write to the cache at session end
+    if not os.getenv("CI"):
+        for plugin in ("cacheprovider", "lfplugin", "nfplugin", "stepwise"):
+            config.pluginmanager.set_blocked(plugin)
+
+
+@pytest.fixture(scope="session")
+def monkeypatch_session():
+    """Session-scoped MonkeyPatch, undone after the last test"""
+    mp = pytest.MonkeyPatch()
+    yield mp
+    mp.undo()
+
+
+@pytest.fixture(scope="session", autouse=True)
+def _env(monkeypatch_session):
+    """Set the server environment explicitly instead of reading .env from disk"""
+    # Replayed cassettes need no real key; export ORS_API_KEY to record new ones. Without it
+    # the live API answers 401/403, which vcr_config refuses to record
+    monkeypatch_session.setenv("ORS_API_KEY", os.getenv("ORS_API_KEY", "test-key"))
+    monkeypatch_session.setenv("USER_AGENT", os.getenv("USER_AGENT", "MapServersProject-tests/1.0"))
+
+
+@pytest.fixture(scope="session")
+def anyio_backend():
+    """Run every async test and fixture on one asyncio loop for the session, on uvloop where available"""
+    # The servers use asyncio primitives directly, so trio is not an option
+    options = {"loop_factory": uvloop.new_event_loop} if uvloop is not None else {}
+    return ("asyncio", options)
+
+
+def _assert_subset(actual, expected):
+    """Assert `actual` has every key of `expected` with an equal value (extra keys are ignored)"""
+    # Compare as dicts so a failure shows pytest's per-key diff
+    assert {key: actual.get(key, "<missing>") for key in expected} == expected
+
+
+@pytest.fixture(scope="session")
+def assert_subset():
+    """Helper asserting a result dict contains the expected items in one comparison"""
+    return _assert_subset
+
+
+@pytest.fixture(scope="session")
+def tool_schema():
+    """Compiled validator for tool definition lists (raises JsonSchemaException on mismatch)"""
+    return validate_tool_definitions
+
+
+@pytest.fixture(scope="session")
+def api_router():
+    """
+    One respx router for the whole session; test modules register their canned responses once.
+    Requests that match no route fail instead of reaching the network.
+    """
+    router = respx.mock(assert_all_called=False)
+    router.start()
+    yield router
+    router.stop()
+
+
+@pytest.fixture(autouse=True)
+def api_mock(request, api_router):
+    """Clear the recorded calls before each test; tests marked remote bypass the mocks"""
+    api_router.reset()
+    if request.node.get_closest_marker("remote"):
+        api_router.stop(clear=False, reset=False)
+        yield None
+        api_router.start()
+        return
+    yield api_router
+
+
+@pytest.fixture(scope="session")
+async def http_client():
+    """One pooled HTTP/2 client shared by every server in the session"""
+    limits = httpx.Limits(max_keepalive_connections=20, max_connections=20)
+    async with httpx.AsyncClient(http2=True, limits=limits) as client:
+        yield client
+
+
+@pytest.fixture(scope="session")
+async def ors_server(http_client):
+    """Create one ORS server for the whole session"""
+    # Disk cache off, so every request reaches the mocks or VCR, the only replay layer
+    async with RouteMCP(ORSParams(cache_dir=""), client=http_client) as server:
+        yield server
+
+
+@pytest.fixture(scope="session")
+async def osm_server(http_client):
+    """Create one OSM server for the whole session"""
+    # Disk cache off, so every request is answered by the mocks (or the live API); no
+    # Nominatim spacing, since the remote suite makes only a single live lookup
+    async with OSMGeoMCP(OSMParams(cache_dir="", nominatim_interval=0), client=http_client) as server:
+        yield server
@@ -0,0 +1,95 @@
+"""
+Unit tests for MapAssistant conversation chaining
+"""
+
+from types import SimpleNamespace
+import pytest
+
+from agent_app import MapAssistant
+
+
+class FakeResponses:
+    """Stand-in for client.responses that replays scripted responses and records each request"""
+
+    def __init__(self, *results):
+        self.results = list(results)
+        self.requests = []
+
+    async def create(self, **params):
+        self.requests.append(params)
+        result = self.results.pop(0)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+
+class FakeClient:
+    """Stand-in for AsyncOpenAI with scripted responses"""
+
+    def __init__(self, *results):
+        self.responses = FakeResponses(*results)
+
+    async def close(self):
+        pass
+
+
+def _response(response_id, output=(), text=""):
+    return SimpleNamespace(id=response_id, status="completed", output=list(output), output_text=text)
+
+
+def _function_call(call_id):
+    # An unknown tool fails argument decoding, so no map server request is made
+    return SimpleNamespace(type="function_call", name="bogus_tool", call_id=call_id, arguments="{}")
+
+
+@pytest.fixture
+async def assistant(monkeypatch):
+    """Non-streaming assistant whose OpenAI client is replaced per test"""
+    # Keep the test environment hermetic: no .env, no on-disk response cache
+    monkeypatch.setattr("dotenv.load_dotenv", lambda *args, **kwargs: False)
+    monkeypatch.setenv("OPENAI_API_KEY", "test-key")
+    monkeypatch.setenv("MAP_CACHE_DIR", "")
+    assistant = MapAssistant(stream=False)
+    await assistant.client.close()
+    yield assistant
+    await assistant.aclose()
+
+
+def _use_responses(assistant, *results):
+    assistant.client = FakeClient(*results)
+    return assistant.client.responses
+
+
+async def test_tool_round_trip_commits_final_response(assistant):
+    """Test the session chains to the final response once the tool outputs are answered"""
+    responses = _use_responses(
+        assistant,
+        _response("resp_1", [_function_call("call_1")]),
+        _response("resp_2", text="Done.")
+    )
+
+    assert await assistant.process_query("where is paris") == "Done."
+
+    assert "previous_response_id" not in responses.requests[0]
+    assert responses.requests[1]["previous_response_id"] == "resp_1"
+    assert responses.requests[1]["input"][0]["call_id"] == "call_1"
+    assert assistant._previous_response_id == "resp_2"
+
+
+async def test_failed_follow_up_does_not_chain_to_unanswered_calls(assistant):
+    """Test a failed tool round-trip leaves the next query chained to the last completed turn"""
+    responses = _use_responses(
+        assistant,
+        _response("resp_1", text="Hello."),
+        _response("resp_2", [_function_call("call_1")]),
+        RuntimeError("connection lost"),
+        _response("resp_3", text="Still here.")
+    )
+
+    await assistant.process_query("hello")
+    with pytest.raises(RuntimeError, match="connection lost"):
+        await assistant.process_query("where is paris")
+
+    assert await assistant.process_query("are you there?") == "Still here."
+    assert responses.requests[-1]["previous_response_id"] == "resp_1"
+    assert responses.requests[-1]["input"] == [{"role": "user", "content": "are you there?"}]
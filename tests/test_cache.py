@@ -0,0 +1,79 @@
+"""
+Unit tests for the on-disk response cache
+"""
+
+import sqlite3
+import pytest
+
+from servers.cache import ResponseCache, resolve_cache_dir
+
+
+@pytest.fixture
+def cache(tmp_path):
+    """Create a response cache in a temporary directory"""
+    cache = ResponseCache(str(tmp_path))
+    yield cache
+    cache.close()
+
+
+def test_set_and_get(cache):
+    """Test a stored body is returned unchanged"""
+    key = cache.key("GET", "https://example.org/search", {"q": "Paris"})
+    cache.set(key, b'[{"lat": "48.85"}]', ttl=60)
+    
+    assert cache.get(key) == b'[{"lat": "48.85"}]'
+
+
+def test_missing_and_expired(cache):
+    """Test missing and expired entries are cache misses"""
+    key = cache.key("GET", "https://example.org/search", {"q": "Paris"})
+    assert cache.get(key) is None
+    
+    cache.set(key, b"[]", ttl=-1)
+    assert cache.get(key) is None
+
+
+def test_evicts_least_recently_used(tmp_path):
+    """Test stores past max_entries evict the entry used longest ago, counting hits as uses"""
+    cache = ResponseCache(str(tmp_path), max_entries=2)
+    cache.set("a", b"1", ttl=60)
+    cache.set("b", b"2", ttl=60)
+    cache.get("a")
+    cache.set("c", b"3", ttl=60)
+    
+    assert [cache.get(key) for key in ("a", "b", "c")] == [b"1", None, b"3"]
+    cache.close()
+
+
+def test_upgrades_database_without_last_used(tmp_path):
+    """Test a cache file from before the LRU cap still opens and keeps its entries"""
+    db = sqlite3.connect(tmp_path / "responses.sqlite3")
+    db.execute("CREATE TABLE responses (key TEXT PRIMARY KEY, body BLOB NOT NULL, expires_at REAL NOT NULL)")
+    db.execute("INSERT INTO responses VALUES ('a', x'31', 1e12)")
+    db.commit()
+    db.close()
+    
+    cache = ResponseCache(str(tmp_path))
+    assert cache.get("a") == b"1"
+    cache.close()
+
+
+def test_key_ignores_dict_order():
+    """Test the key is built from the canonicalized request"""
+    first = ResponseCache.key("POST", "https://example.org", {"a": 1, "b": [1, 2]})
+    second = ResponseCache.key("POST", "https://example.org", {"b": [1, 2], "a": 1})
+    
+    assert first == second
+    assert first != ResponseCache.key("POST", "https://example.org", {"a": 2, "b": [1, 2]})
+
+
+def test_resolve_cache_dir(monkeypatch):
+    """Test explicit directory, environment override and disabling"""
+    monkeypatch.setenv("MAP_CACHE_DIR", "/tmp/map-cache")
+    
+    assert resolve_cache_dir("/srv/cache") == "/srv/cache"
+    assert resolve_cache_dir(None) == "/tmp/map-cache"
+    assert resolve_cache_dir("") is None
+    
+    monkeypatch.setenv("MAP_CACHE_DIR", "")
+    assert resolve_cache_dir(None) is None
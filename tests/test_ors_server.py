@@ -2,123 +2,204 @@
 Unit tests for RouteMCP server
 """
 
+import asyncio
+import gzip
+import anyio
+import httpx
+import orjson
 import pytest
-import sys
 import os
-from dotenv import load_dotenv
+import numpy as np
 
-# Load environment variables
-load_dotenv()
+from servers.ors_server import RouteMCP, ServerParams
 
-# Add src to path
-sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+# Test locations as (lon, lat) tuples, shared by every test instead of rebuilt per test
+PARIS = (2.3522, 48.8566)       # Paris center
+EIFFEL_TOWER = (2.2945, 48.8584)
+NOTRE_DAME = (2.3488, 48.8534)  # Notre-Dame area
+COORDS_PARIS_EIFFEL = (PARIS, EIFFEL_TOWER)
 
-from servers.ors_server import RouteMCP, ServerParams
+# Canned ORS answers for the offline tests; the second route and isochrone lack the optional fields
+ROUTE_RESULT = {
+    "routes": [
+        {"summary": {"distance": 5123.4, "duration": 812.7}, "geometry": "ezmiHaxsM",
+         "segments": [{"steps": [{"instruction": "Head west on Rue de Rivoli", "distance": 120.5}]}]},
+        {"geometry": "gqmiHmltM"}
+    ]
+}
+
+ISOCHRONE_RESULT = {
+    "features": [
+        {"properties": {"value": 300, "center": [2.3522, 48.8566]},
+         "geometry": {"type": "Polygon", "coordinates": [[[2.34, 48.85], [2.36, 48.85], [2.35, 48.86], [2.34, 48.85]]]}},
+        {"geometry": None}
+    ]
+}
+
+# Unreachable pairs come back as null
+MATRIX_RESULT = {
+    "durations": [[0.0, 600.5, None], [610.2, 0.0, None], [None, None, 0.0]],
+    "distances": [[0.0, 12345.67, None], [4790.5, 0.0, None], [None, None, 0.0]]
+}
+
+
+# Response headers that differ on every request; they are dropped before a cassette is written
+VOLATILE_HEADERS = {"date", "age", "x-request-id", "cf-ray", "set-cookie"}
+
+
+def _drop_error_response(response):
+    """Refuse to record a non-2xx response (such as a 401/403 from a missing key), so it never becomes a replayed baseline"""
+    return response if 200 <= response["status"]["code"] < 300 else None
 
 
-@pytest.fixture
-def ors_server():
-    """Create ORS server instance for testing"""
-    params = ServerParams()
-    return RouteMCP(params)
+def _scrub_response(response):
+    """Strip per-request details from a recorded response, so re-recording an unchanged answer leaves its cassette unchanged"""
+    # Runs after decode_compressed_response, which already deep-copied the response
+    response["headers"] = {
+        name: values for name, values in response["headers"].items()
+        if name.lower() not in VOLATILE_HEADERS and not name.lower().startswith("x-ratelimit-")
+    }
+    try:
+        data = orjson.loads(response["body"]["string"])
+    except orjson.JSONDecodeError:
+        return response
+    metadata = data.get("metadata") if isinstance(data, dict) else None
+    if metadata:
+        # The request timestamp and the engine/graph build change independently of the answer
+        metadata["timestamp"] = 0
+        metadata.pop("engine", None)
+        body = orjson.dumps(data)
+        response["body"]["string"] = body
+        for name in response["headers"]:
+            if name.lower() == "content-length":
+                response["headers"][name] = [str(len(body))]
+    return response
 
 
-@pytest.mark.asyncio
-async def test_route(ors_server):
+@pytest.fixture(scope="module")
+def vcr_config():
+    """Replay ORS responses from tests/cassettes/test_ors_server/, recording missing ones once"""
+    return {
+        # Keep the ORS API key out of the recorded cassettes
+        "filter_headers": ["authorization", "Authorization"],
+        # Error responses are not recorded: the test fails live and the cassette stays missing
+        "before_record_response": (_drop_error_response, _scrub_response),
+        # Set VCR_RECORD_MODE=none in CI to fail on any request without a cassette; under
+        # pytest-xdist it defaults to none so parallel workers never race on cassette writes
+        "record_mode": os.getenv("VCR_RECORD_MODE", "none" if os.getenv("PYTEST_XDIST_WORKER") else "once"),
+        "match_on": ["method", "uri", "body"],
+        "decode_compressed_response": True
+    }
+
+
+@pytest.fixture(scope="module", autouse=True)
+def ors_routes(api_router):
+    """Register the canned ORS responses on the session router once for this module"""
+    base = f"{ServerParams().ors_url}/v2"
+    api_router.post(url__startswith=f"{base}/directions/").mock(return_value=httpx.Response(200, json=ROUTE_RESULT))
+    api_router.post(url__startswith=f"{base}/isochrones/").mock(return_value=httpx.Response(200, json=ISOCHRONE_RESULT))
+    api_router.post(url__startswith=f"{base}/matrix/").mock(return_value=httpx.Response(200, json=MATRIX_RESULT))
+
+
+@pytest.mark.remote
+@pytest.mark.vcr()
+async def test_route(ors_server, assert_subset):
     """Test route calculation between two points"""
     # Route from Paris center to Eiffel Tower
-    coordinates = [
-        [2.3522, 48.8566],  # Paris center [lon, lat]
-        [2.2945, 48.8584]   # Eiffel Tower
-    ]
+    result = await ors_server.route(COORDS_PARIS_EIFFEL, profile="driving-car")
     
-    result = await ors_server.route(coordinates, profile="driving-car")
-    
-    assert result["operation"] == "route"
-    assert result["profile"] == "driving-car"
-    assert result["coordinates"] == coordinates
-    assert "routes" in result
+    assert_subset(result, {"operation": "route", "profile": "driving-car", "coordinates": COORDS_PARIS_EIFFEL})
     assert len(result["routes"]) >= 1
     
     # Check route details
     route = result["routes"][0]
-    assert "distance" in route
-    assert "duration" in route
-    assert route["distance"] > 0
-    assert route["duration"] > 0
+    assert route["distance"] > 0 and route["duration"] > 0
 
 
-@pytest.mark.asyncio
-async def test_route_multiple_points(ors_server):
+@pytest.mark.remote
+@pytest.mark.vcr()
+async def test_route_multiple_points(ors_server, assert_subset):
     """Test route with multiple waypoints"""
-    coordinates = [
-        [2.3522, 48.8566],  # Point A
-        [2.2945, 48.8584],  # Point B
-        [2.3488, 48.8534]   # Point C
-    ]
-    
-    result = await ors_server.route(coordinates, profile="foot-walking")
+    result = await ors_server.route((PARIS, EIFFEL_TOWER, NOTRE_DAME), profile="foot-walking")
     
-    assert result["operation"] == "route"
-    assert result["profile"] == "foot-walking"
+    assert_subset(result, {"operation": "route", "profile": "foot-walking"})
     assert len(result["routes"]) >= 1
 
 
-@pytest.mark.asyncio
-async def test_route_invalid_coordinates(ors_server):
-    """Test that invalid input raises error"""
-    with pytest.raises(ValueError, match="At least 2 coordinates required"):
-        await ors_server.route([[2.3522, 48.8566]], profile="driving-car")
-
-
-@pytest.mark.asyncio
-async def test_isochrone(ors_server):
-    """Test isochrone calculation"""
-    # 5 and 10 minute driving isochrones from Paris center
-    location = [2.3522, 48.8566]  # [lon, lat]
-    
+@pytest.mark.remote
+@pytest.mark.vcr()
+@pytest.mark.parametrize("profile,range_type,range_values", [
+    ("driving-car", "time", [300, 600]),      # 5 and 10 minutes in seconds
+    ("foot-walking", "distance", [500, 1000])  # 500m and 1000m
+], ids=["time", "distance"])
+async def test_isochrone_variants(ors_server, assert_subset, profile, range_type, range_values):
+    """Test time- and distance-based isochrone calculation"""
     result = await ors_server.isochrone(
-        location=location,
-        profile="driving-car",
-        range_values=[300, 600],  # 5 and 10 minutes in seconds
-        range_type="time"
+        location=PARIS,
+        profile=profile,
+        range_values=range_values,
+        range_type=range_type
     )
     
-    assert result["operation"] == "isochrone"
-    assert result["profile"] == "driving-car"
-    assert result["location"] == location
-    assert result["range_type"] == "time"
-    assert "isochrones" in result
+    assert_subset(result, {
+        "operation": "isochrone",
+        "profile": profile,
+        "location": PARIS,
+        "range_type": range_type
+    })
     
-    # Should have 2 isochrones (one for each range value)
-    assert len(result["isochrones"]) == 2
+    # One isochrone per range value
+    assert len(result["isochrones"]) == len(range_values)
 
 
-@pytest.mark.asyncio
-async def test_isochrone_distance(ors_server):
-    """Test distance-based isochrone"""
-    location = [2.3522, 48.8566]
-    
-    result = await ors_server.isochrone(
-        location=location,
-        profile="foot-walking",
-        range_values=[500, 1000],  # 500m and 1000m
-        range_type="distance"
+@pytest.mark.remote
+@pytest.mark.vcr()
+async def test_concurrent_requests(ors_server):
+    """Test independent route and isochrone calls run concurrently over the shared client"""
+    to_eiffel, to_notre_dame, isochrone = await asyncio.gather(
+        ors_server.route(COORDS_PARIS_EIFFEL, profile="driving-car"),
+        ors_server.route((PARIS, NOTRE_DAME), profile="foot-walking"),
+        ors_server.isochrone(PARIS, profile="driving-car", range_values=[300])
     )
     
-    assert result["operation"] == "isochrone"
-    assert result["range_type"] == "distance"
+    assert to_eiffel["routes"][0]["distance"] > 0
+    assert to_notre_dame["profile"] == "foot-walking"
+    assert to_notre_dame["routes"][0]["distance"] > 0
+    assert len(isochrone["isochrones"]) == 1
+
+
+def _paris_locations(n):
+    """First n test locations: three Paris landmarks, then points on a 0.01° grid nearby"""
+    grid = [(round(2.33 + 0.01 * (i % 4), 4), round(48.85 + 0.01 * (i // 4), 4)) for i in range(n)]
+    return ([PARIS, EIFFEL_TOWER, NOTRE_DAME] + grid)[:n]
+
+
+@pytest.mark.remote
+@pytest.mark.vcr()
+async def test_concurrent_routes(ors_server):
+    """Test a task group of routes fanning out over the shared HTTP/2 client"""
+    # Paris center to each of ten other test locations
+    locations = _paris_locations(11)
+    coordinate_pairs = [(PARIS, destination) for destination in locations[1:]]
+    results = []
+    
+    async def one(coordinates):
+        results.append(await ors_server.route(coordinates, profile="driving-car"))
+    
+    async with anyio.create_task_group() as tg:
+        for coordinates in coordinate_pairs:
+            tg.start_soon(one, coordinates)
+    
+    assert len(results) == 10
+    assert all(result["routes"][0]["distance"] > 0 for result in results)
 
 
-@pytest.mark.asyncio
-async def test_matrix(ors_server):
+@pytest.mark.remote
+@pytest.mark.vcr()
+@pytest.mark.parametrize("n", [3, 5, 10])
+async def test_matrix(ors_server, assert_subset, n):
     """Test distance/duration matrix calculation"""
-    # Three locations in Paris
-    locations = [
-        [2.3522, 48.8566],  # Paris center
-        [2.2945, 48.8584],  # Eiffel Tower
-        [2.3488, 48.8534]   # Notre-Dame area
-    ]
+    locations = _paris_locations(n)
     
     result = await ors_server.matrix(
         locations=locations,
@@ -126,66 +207,178 @@ async def test_matrix(ors_server):
         metrics=["distance", "duration"]
     )
     
-    assert result["operation"] == "matrix"
-    assert result["profile"] == "driving-car"
-    assert result["locations"] == locations
+    assert_subset(result, {"operation": "matrix", "profile": "driving-car", "locations": locations})
     
-    # Check matrix dimensions (3x3)
-    assert len(result["durations"]) == 3
-    assert len(result["distances"]) == 3
-    for row in result["durations"]:
-        assert len(row) == 3
-    for row in result["distances"]:
-        assert len(row) == 3
+    # Matrices come back as n x n arrays
+    durations = np.asarray(result["durations"])
+    distances = np.asarray(result["distances"])
+    assert durations.shape == distances.shape == (n, n)
     
     # Diagonal should be 0 (distance from point to itself)
-    for i in range(3):
-        assert result["durations"][i][i] == 0.0
-        assert result["distances"][i][i] == 0.0
+    np.testing.assert_array_equal(np.diag(durations), 0.0)
+    np.testing.assert_array_equal(np.diag(distances), 0.0)
+
+
+async def test_route_transform(ors_server, api_mock, assert_subset):
+    """Test the route request body and the transform of full and bare routes"""
+    result = await ors_server.route(COORDS_PARIS_EIFFEL, profile="driving-car")
+    
+    assert_subset(result, {"operation": "route", "profile": "driving-car", "coordinates": COORDS_PARIS_EIFFEL})
+    assert result["routes"] == [
+        {"distance": 5123.4, "duration": 812.7, "geometry": "ezmiHaxsM",
+         "instructions": [{"instruction": "Head west on Rue de Rivoli", "distance": 120.5}]},
+        {"distance": None, "duration": None, "geometry": "gqmiHmltM", "instructions": ()}
+    ]
+    
+    # One compact orjson body, posted to the profile's JSON endpoint with the API key
+    request = api_mock.calls.last.request
+    assert request.url == "https://api.openrouteservice.org/v2/directions/driving-car/json"
+    assert request.headers["Authorization"] == "test-key"
+    assert request.content == orjson.dumps(
+        {"coordinates": COORDS_PARIS_EIFFEL, "instructions": True, "elevation": False}
+    )
 
 
-@pytest.mark.asyncio
-async def test_matrix_invalid_locations(ors_server):
-    """Test that invalid input raises error"""
-    with pytest.raises(ValueError, match="At least 2 locations required"):
-        await ors_server.matrix([[2.3522, 48.8566]], profile="driving-car")
+async def test_route_without_instructions(ors_server):
+    """Test instructions are left out when not requested"""
+    result = await ors_server.route(COORDS_PARIS_EIFFEL, instructions=False)
+    
+    assert [route["instructions"] for route in result["routes"]] == [(), ()]
 
 
-def test_get_tool_definitions(ors_server):
-    """Test that tool definitions are properly formatted"""
-    tools = ors_server.get_tool_definitions()
+async def test_isochrone_transform(ors_server, api_mock, assert_subset):
+    """Test the isochrone request body and the transform of full and bare features"""
+    result = await ors_server.isochrone(PARIS, profile="foot-walking", range_values=[300])
     
-    assert len(tools) == 3
+    assert_subset(result, {"operation": "isochrone", "profile": "foot-walking", "location": PARIS})
+    assert result["isochrones"] == [
+        {"value": 300, "range_type": "time", "center": [2.3522, 48.8566],
+         "geometry": ISOCHRONE_RESULT["features"][0]["geometry"]},
+        {"value": None, "range_type": "time", "center": None, "geometry": None}
+    ]
+    assert orjson.loads(api_mock.calls.last.request.content) == {
+        "locations": [list(PARIS)], "range": [300], "range_type": "time"
+    }
+
+
+async def test_matrix_unreachable_pairs(ors_server):
+    """Test matrices come back as float32 arrays with NaN for unreachable pairs"""
+    result = await ors_server.matrix((PARIS, EIFFEL_TOWER, NOTRE_DAME))
     
-    # Verify tool names
-    tool_names = [tool["function"]["name"] for tool in tools]
-    assert "ors_route" in tool_names
-    assert "ors_isochrone" in tool_names
-    assert "ors_matrix" in tool_names
+    durations = result["durations"]
+    assert durations.dtype == np.float32
+    assert durations.shape == (3, 3)
+    np.testing.assert_array_equal(np.isnan(durations), [[False, False, True], [False, False, True], [True, True, False]])
+    np.testing.assert_allclose(durations[0, 1], 600.5)
+    np.testing.assert_allclose(result["distances"][1, 0], 4790.5)
+
+
+async def test_matrix_as_lists(ors_server):
+    """Test as_numpy=False returns the ORS rows unchanged, without float32 rounding or NaN"""
+    result = await ors_server.matrix((PARIS, EIFFEL_TOWER, NOTRE_DAME), as_numpy=False)
     
-    # Check structure
-    for tool in tools:
-        assert tool["type"] == "function"
-        assert "function" in tool
-        assert "name" in tool["function"]
-        assert "description" in tool["function"]
-        assert "parameters" in tool["function"]
+    assert result["durations"] == MATRIX_RESULT["durations"]
+    assert result["distances"] == MATRIX_RESULT["distances"]
+
+
+async def test_response_cache(http_client, api_mock, tmp_path):
+    """Test a repeated request is answered from the disk cache without another POST"""
+    async with RouteMCP(ServerParams(cache_dir=str(tmp_path)), client=http_client) as server:
+        first = await server.route(COORDS_PARIS_EIFFEL)
+        second = await server.route(COORDS_PARIS_EIFFEL)
+    
+    assert second == first
+    assert api_mock.calls.call_count == 1
+
+
+async def test_gzip_large_request(http_client, api_mock):
+    """Test large bodies are gzipped when gzip_requests is set and small ones are sent as-is"""
+    # About 500 locations is well over the 4 KB threshold
+    locations = [(2.3 + i * 1e-4, 48.8 + i * 1e-4) for i in range(500)]
+    
+    async with RouteMCP(ServerParams(cache_dir="", gzip_requests=True), client=http_client) as server:
+        await server.matrix(locations)
+        large = api_mock.calls.last.request
+        await server.matrix(locations[:3])
+        small = api_mock.calls.last.request
+    
+    assert large.headers["Content-Encoding"] == "gzip"
+    assert orjson.loads(gzip.decompress(large.content))["locations"] == [list(pair) for pair in locations]
+    assert "Content-Encoding" not in small.headers
+
 
+def test_scrub_recorded_response():
+    """Test two recordings of the same answer, taken at different times, scrub to the same cassette entry"""
+    def recording(timestamp, remaining):
+        body = orjson.dumps({**ROUTE_RESULT, "metadata": {"timestamp": timestamp, "engine": {"build_date": "2026-10-0" + remaining}}})
+        headers = {"content-type": ["application/json"], "content-length": [str(len(body))],
+                   "date": [f"Wed, 14 Oct 2026 03:0{remaining}:00 GMT"], "x-ratelimit-remaining": [remaining]}
+        return {"status": {"code": 200, "message": "OK"}, "headers": headers, "body": {"string": body}}
 
-@pytest.mark.asyncio
+    first, second = _scrub_response(recording(1791946800000, "1")), _scrub_response(recording(1792033200000, "2"))
+
+    assert first == second
+    assert set(first["headers"]) == {"content-type", "content-length"}
+    assert first["headers"]["content-length"] == [str(len(first["body"]["string"]))]
+    assert orjson.loads(first["body"]["string"])["metadata"] == {"timestamp": 0}
+
+
+@pytest.mark.parametrize("code,recorded", [(200, True), (401, False), (403, False), (429, False)])
+def test_drop_error_response(code, recorded):
+    """Test only successful responses are written to a cassette"""
+    response = {"status": {"code": code, "message": ""}, "headers": {}, "body": {"string": b"{}"}}
+    
+    assert (_drop_error_response(response) is not None) == recorded
+
+
+@pytest.mark.parametrize("call,args,message", [
+    ("route", ((PARIS,), "driving-car"), "At least 2 coordinates required"),
+    ("matrix", ((PARIS,), "driving-car"), "At least 2 locations required"),
+    ("execute_tool", ("invalid_tool", {}), "Unknown tool"),
+    ("execute_tool_bytes", ("invalid_tool", {}), "Unknown tool")
+], ids=["route", "matrix", "execute_tool", "execute_tool_bytes"])
+async def test_validation_errors(ors_server, call, args, message):
+    """Test that invalid input raises an error before any request is made"""
+    with pytest.raises(ValueError, match=message):
+        await getattr(ors_server, call)(*args)
+
+
+def test_get_tool_definitions(ors_server, tool_schema):
+    """Test that tool definitions are properly formatted"""
+    tools = ors_server.get_tool_definitions()
+    
+    tool_schema(tools)
+    assert {tool["function"]["name"] for tool in tools} == {"ors_route", "ors_isochrone", "ors_matrix"}
+
+
+def test_get_tool_definitions_is_shared(ors_server):
+    """Test that tool definitions are built once and shared, not rebuilt per call"""
+    assert ors_server.get_tool_definitions() is ors_server.get_tool_definitions()
+    assert ors_server.get_tool_definitions() is type(ors_server).get_tool_definitions()
+
+
+# Same request as test_route, so replay its cassette
+@pytest.mark.remote
+@pytest.mark.vcr("test_route.yaml")
 async def test_execute_tool_route(ors_server):
     """Test tool execution dispatcher"""
     result = await ors_server.execute_tool(
         "ors_route",
-        {"coordinates": [[2.3522, 48.8566], [2.2945, 48.8584]]}
+        {"coordinates": COORDS_PARIS_EIFFEL}
     )
     
     assert result["operation"] == "route"
     assert len(result["routes"]) >= 1
 
 
-@pytest.mark.asyncio
-async def test_execute_tool_invalid(ors_server):
-    """Test that invalid tool names raise errors"""
-    with pytest.raises(ValueError, match="Unknown tool"):
-        await ors_server.execute_tool("invalid_tool", {})
+async def test_execute_tool_dispatch(ors_server, monkeypatch):
+    """Test that every tool has a dispatch entry and calls resolve to the instance's method"""
+    assert set(ors_server._DISPATCH) == {tool["function"]["name"] for tool in ors_server.get_tool_definitions()}
+    
+    async def fake_route(**arguments):
+        return arguments
+    
+    monkeypatch.setattr(ors_server, "route", fake_route)
+    arguments = {"coordinates": COORDS_PARIS_EIFFEL}
+    
+    assert await ors_server.execute_tool("ors_route", arguments) == arguments
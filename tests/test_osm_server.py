@@ -2,63 +2,122 @@
 Unit tests for OSMGeoMCP server
 """
 
+import asyncio
 import pytest
-import sys
-import os
+import httpx
 
-# Add src to path
-sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+from servers.osm_server import OSMGeoMCP, ServerParams, _amenity_filter
 
-from servers.osm_server import OSMGeoMCP, ServerParams
 
+EIFFEL_TOWER = {
+    "display_name": "Tour Eiffel, 5, Avenue Anatole France, Quartier du Gros-Caillou, "
+                    "Paris 7e Arrondissement, Paris, Île-de-France, France métropolitaine, 75007, France",
+    "lat": "48.8582599",
+    "lon": "2.2945006",
+    "importance": 0.6205937724353116,
+    "address": {"tourism": "Tour Eiffel", "city": "Paris", "postcode": "75007", "country": "France"},
+    "boundingbox": ["48.8574753", "48.8590453", "2.2933119", "2.2956897"]
+}
 
-@pytest.fixture
-def osm_server():
-    """Create OSM server instance for testing"""
+# Canned Nominatim /search results, keyed by query
+GEOCODE_RESULTS = {
+    "Eiffel Tower, Paris": [EIFFEL_TOWER],
+    "Louvre Museum, Paris": [{
+        "display_name": "Musée du Louvre, Rue de Rivoli, Quartier Saint-Germain-l'Auxerrois, "
+                        "Paris 1er Arrondissement, Paris, Île-de-France, France métropolitaine, 75001, France",
+        "lat": "48.8611473",
+        "lon": "2.3380277",
+        "importance": 0.6530461106758687,
+        "address": {"tourism": "Musée du Louvre", "city": "Paris", "postcode": "75001", "country": "France"}
+    }],
+    "London, UK": [{
+        "display_name": "London, Greater London, England, United Kingdom",
+        "lat": "51.5074456",
+        "lon": "-0.1277653",
+        "importance": 0.8175766114518461,
+        "address": {"city": "London", "state": "England", "country": "United Kingdom"}
+    }]
+}
+
+# Canned Overpass answer: a node, a way with a center, and a relation without one (skipped)
+OVERPASS_RESULT = {
+    "elements": [
+        {"type": "node", "id": 1, "lat": 48.8581, "lon": 2.2937,
+         "tags": {"amenity": "restaurant", "name": "Le Jules Verne"}},
+        {"type": "way", "id": 2, "center": {"lat": 48.8567, "lon": 2.2975},
+         "tags": {"amenity": "restaurant", "name": "Café de l'Homme"}},
+        {"type": "relation", "id": 3, "tags": {"amenity": "restaurant"}}
+    ]
+}
+
+
+def _search(request):
+    """Answer a Nominatim /search request from GEOCODE_RESULTS"""
+    params = request.url.params
+    results = GEOCODE_RESULTS.get(params["q"], [])
+    return httpx.Response(200, json=results[:int(params["limit"])])
+
+
+@pytest.fixture(scope="module", autouse=True)
+def osm_routes(api_router):
+    """Register the canned Nominatim/Overpass responses on the session router once for this module"""
     params = ServerParams()
-    return OSMGeoMCP(params)
+    api_router.get(f"{params.nominatim_url}/search").mock(side_effect=_search)
+    api_router.get(f"{params.nominatim_url}/reverse").mock(return_value=httpx.Response(200, json=EIFFEL_TOWER))
+    api_router.post(params.overpass_url).mock(return_value=httpx.Response(200, json=OVERPASS_RESULT))
 
 
-@pytest.mark.asyncio
-async def test_forward_geocode(osm_server):
+async def test_forward_geocode(osm_server, assert_subset):
     """Test forward geocoding (address to coordinates)"""
     result = await osm_server.forward_geocode("Eiffel Tower, Paris", limit=1)
     
-    assert result["operation"] == "forward_geocode"
-    assert result["query"] == "Eiffel Tower, Paris"
-    assert result["count"] >= 1
-    assert len(result["results"]) >= 1
+    assert_subset(result, {"operation": "forward_geocode", "query": "Eiffel Tower, Paris", "count": 1})
     
-    # Check first result has required fields
     first_result = result["results"][0]
-    assert "lat" in first_result
-    assert "lon" in first_result
-    assert "display_name" in first_result
+    assert_subset(first_result, {
+        "lat": 48.8582599,
+        "lon": 2.2945006,
+        "display_name": EIFFEL_TOWER["display_name"]
+    })
+    assert first_result["address"]["city"] == "Paris"
+
+
+@pytest.mark.remote
+async def test_forward_geocode_remote(osm_server):
+    """Test forward geocoding against the live Nominatim API"""
+    result = await osm_server.forward_geocode("Eiffel Tower, Paris", limit=1)
+    
+    assert result["count"] >= 1
     
-    # Verify it's roughly in Paris (loose check)
+    # Verify it's roughly in Paris (loose check, live data can move)
+    first_result = result["results"][0]
     assert 48.0 < first_result["lat"] < 49.0
     assert 2.0 < first_result["lon"] < 3.0
 
 
-@pytest.mark.asyncio
-async def test_reverse_geocode(osm_server):
+async def test_forward_geocode_many(osm_server):
+    """Test concurrent forward geocoding keeps results in query order"""
+    queries = ["Eiffel Tower, Paris", "Louvre Museum, Paris"]
+    results = await osm_server.forward_geocode_many(queries, limit=1)
+    
+    assert [r["query"] for r in results] == queries
+    assert [r["results"][0]["lat"] for r in results] == [48.8582599, 48.8611473]
+
+
+async def test_reverse_geocode(osm_server, assert_subset):
     """Test reverse geocoding (coordinates to address)"""
     # Eiffel Tower coordinates
     result = await osm_server.reverse_geocode(48.8584, 2.2945)
     
-    assert result["operation"] == "reverse_geocode"
-    assert result["coordinates"]["lat"] == 48.8584
-    assert result["coordinates"]["lon"] == 2.2945
-    assert "address" in result
-    assert "display_name" in result["address"]
-    
-    # Should mention Paris
-    display_name = result["address"]["display_name"].lower()
-    assert "paris" in display_name
+    assert_subset(result, {"operation": "reverse_geocode", "coordinates": {"lat": 48.8584, "lon": 2.2945}})
+    assert_subset(result["address"], {
+        "display_name": EIFFEL_TOWER["display_name"],
+        "boundingbox": EIFFEL_TOWER["boundingbox"]
+    })
+    assert result["address"]["address"]["postcode"] == "75007"
 
 
-@pytest.mark.asyncio
-async def test_poi_search(osm_server):
+async def test_poi_search(osm_server, api_mock, assert_subset):
     """Test POI search near a location"""
     # Search for restaurants near Eiffel Tower
     result = await osm_server.poi_search(
@@ -69,42 +128,114 @@ async def test_poi_search(osm_server):
         limit=10
     )
     
-    assert result["operation"] == "poi_search"
-    assert result["query"] == "restaurant"
-    assert result["center"]["lat"] == 48.8584
-    assert result["center"]["lon"] == 2.2945
-    assert result["radius"] == 500
-    assert "count" in result
-    assert "results" in result
+    # The relation without a center is skipped
+    assert_subset(result, {
+        "operation": "poi_search",
+        "query": "restaurant",
+        "center": {"lat": 48.8584, "lon": 2.2945},
+        "radius": 500,
+        "count": 2
+    })
+    assert [poi["name"] for poi in result["results"]] == ["Le Jules Verne", "Café de l'Homme"]
+    assert result["results"][1]["lat"] == 48.8567
+    
+    # The plain amenity is sent as an exact tag match
+    overpass_query = api_mock.calls.last.request.content.decode()
+    assert "amenity%22%3D%22restaurant" in overpass_query
+
+
+async def test_concurrent_requests(osm_server):
+    """Test forward geocode, reverse geocode and POI search run concurrently over the shared client"""
+    forward, reverse, pois = await asyncio.gather(
+        osm_server.forward_geocode("Eiffel Tower, Paris", limit=1),
+        osm_server.reverse_geocode(48.8584, 2.2945),
+        osm_server.poi_search("restaurant", 48.8584, 2.2945, radius=500)
+    )
+    
+    assert forward["results"][0]["lat"] == 48.8582599
+    assert reverse["address"]["address"]["postcode"] == "75007"
+    assert pois["count"] == 2
+
+
+class FakeClock:
+    """Clock whose sleep records the requested delay and advances time instantly"""
+    
+    def __init__(self):
+        self.now = 1000.0
+        self.sleeps = []
+    
+    def __call__(self):
+        return self.now
+    
+    async def sleep(self, delay):
+        self.sleeps.append(delay)
+        self.now += delay
+
+
+@pytest.fixture
+def fake_clock():
+    return FakeClock()
+
+
+@pytest.fixture
+def nominatim_params(api_router):
+    """Rate-limited server params on a Nominatim host of its own, with a canned /reverse answer"""
+    # A separate host, so the canned /reverse route of the other tests is left alone
+    params = ServerParams(nominatim_url="https://nominatim.test", cache_dir="", nominatim_interval=1.0)
+    api_router.get(f"{params.nominatim_url}/reverse").mock(return_value=httpx.Response(200, json=EIFFEL_TOWER))
+    return params
+
+
+def _with_clock(server, clock):
+    server._clock, server._sleep = clock, clock.sleep
+    return server
+
+
+async def test_nominatim_rate_limit(http_client, nominatim_params, fake_clock):
+    """Test uncached Nominatim lookups wait out nominatim_interval between starts, even when batched"""
+    async with _with_clock(OSMGeoMCP(nominatim_params, client=http_client), fake_clock) as server:
+        await asyncio.gather(*(server.reverse_geocode(48.8584, 2.2945 + i * 1e-3) for i in range(5)))
+    
+    # The first lookup goes straight out; each later one waits a full interval on the fake clock
+    assert fake_clock.sleeps == [1.0] * 4
+
+
+async def test_warmup_counts_against_nominatim_spacing(http_client, nominatim_params, fake_clock, api_router):
+    """Test a lookup right after warmup waits an interval behind the warmup HEAD"""
+    api_router.head(nominatim_params.nominatim_url).mock(return_value=httpx.Response(200))
+    api_router.head(nominatim_params.overpass_url).mock(return_value=httpx.Response(200))
+    
+    async with _with_clock(OSMGeoMCP(nominatim_params, client=http_client), fake_clock) as server:
+        await server.warmup()
+        await server.reverse_geocode(48.8584, 2.2945)
     
-    # Should find at least some restaurants (may vary)
-    # Note: This might occasionally fail if OSM data changes
-    # For a real test, we'd use mocking
-    assert isinstance(result["results"], list)
+    assert fake_clock.sleeps == [1.0]
 
 
-def test_get_tool_definitions(osm_server):
+def test_amenity_filter():
+    """Test plain amenities use an exact match and patterns stay escaped regexes"""
+    assert _amenity_filter("cafe") == '["amenity"="cafe"]'
+    assert _amenity_filter("fast_food") == '["amenity"="fast_food"]'
+    assert _amenity_filter("cafe|bar") == '["amenity"~"cafe|bar",i]'
+    assert _amenity_filter('cafe"];out;') == '["amenity"~"cafe\\"];out;",i]'
+
+
+def test_get_tool_definitions(osm_server, tool_schema):
     """Test that tool definitions are properly formatted"""
     tools = osm_server.get_tool_definitions()
     
-    assert len(tools) == 3
-    
-    # Check each tool has required structure
-    for tool in tools:
-        assert tool["type"] == "function"
-        assert "function" in tool
-        assert "name" in tool["function"]
-        assert "description" in tool["function"]
-        assert "parameters" in tool["function"]
-        
-        # Check parameters structure
-        params = tool["function"]["parameters"]
-        assert params["type"] == "object"
-        assert "properties" in params
-        assert "required" in params
+    tool_schema(tools)
+    assert {tool["function"]["name"] for tool in tools} == {
+        "osm_forward_geocode", "osm_reverse_geocode", "osm_poi_search"
+    }
+
+
+def test_get_tool_definitions_is_shared(osm_server):
+    """Test that tool definitions are built once and shared, not rebuilt per call"""
+    assert osm_server.get_tool_definitions() is osm_server.get_tool_definitions()
+    assert osm_server.get_tool_definitions() is type(osm_server).get_tool_definitions()
 
 
-@pytest.mark.asyncio
 async def test_execute_tool_forward_geocode(osm_server):
     """Test tool execution dispatcher"""
     result = await osm_server.execute_tool(
@@ -113,11 +244,15 @@ async def test_execute_tool_forward_geocode(osm_server):
     )
     
     assert result["operation"] == "forward_geocode"
-    assert result["count"] >= 1
+    assert result["count"] == 1
+    assert result["results"][0]["lon"] == -0.1277653
 
 
-@pytest.mark.asyncio
-async def test_execute_tool_invalid(osm_server):
-    """Test that invalid tool names raise errors"""
-    with pytest.raises(ValueError, match="Unknown tool"):
-        await osm_server.execute_tool("invalid_tool", {})
+@pytest.mark.parametrize("call,args,message", [
+    ("execute_tool", ("invalid_tool", {}), "Unknown tool"),
+    ("execute_tool_bytes", ("invalid_tool", {}), "Unknown tool")
+], ids=["execute_tool", "execute_tool_bytes"])
+async def test_validation_errors(osm_server, call, args, message):
+    """Test that invalid input raises an error before any request is made"""
+    with pytest.raises(ValueError, match=message):
+        await getattr(osm_server, call)(*args)
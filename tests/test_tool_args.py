@@ -0,0 +1,44 @@
+"""
+Unit tests for tool-call argument decoding
+"""
+
+import pytest
+
+from servers import TOOL_DEFINITIONS
+from servers.tool_args import DECODERS, decode_arguments
+
+
+def test_decoders_cover_all_tools():
+    """Test that every advertised tool has an argument decoder"""
+    tool_names = {tool["function"]["name"] for tool in TOOL_DEFINITIONS}
+    assert set(DECODERS) == tool_names
+
+
+def test_decode_omits_unset_defaults():
+    """Test that arguments left out by the model are not passed to the server"""
+    args = decode_arguments("osm_forward_geocode", '{"query": "Eiffel Tower, Paris"}')
+    
+    assert args == {"query": "Eiffel Tower, Paris"}
+
+
+def test_decode_route_coordinates():
+    """Test that coordinate pairs are decoded and validated"""
+    args = decode_arguments(
+        "ors_route",
+        '{"coordinates": [[2.3522, 48.8566], [2.2945, 48.8584]], "profile": "foot-walking"}'
+    )
+    
+    assert args["coordinates"] == [(2.3522, 48.8566), (2.2945, 48.8584)]
+    assert args["profile"] == "foot-walking"
+
+
+def test_decode_invalid_arguments():
+    """Test that arguments not matching the schema raise errors"""
+    with pytest.raises(ValueError, match="Invalid arguments for osm_reverse_geocode"):
+        decode_arguments("osm_reverse_geocode", '{"lat": "north"}')
+
+
+def test_decode_unknown_tool():
+    """Test that unknown tool names raise errors"""
+    with pytest.raises(ValueError, match="Unknown tool"):
+        decode_arguments("invalid_tool", "{}")